@@ -1,5 +1,10 @@
+import os
+import sys
 import time
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import pyvisa as visa
 from pyvisa import constants as pyconst
@@ -9,6 +14,70 @@ class bATEinst_Exception(Exception):
     pass
 
 
+class CalTable(object):
+    """Calibration curve held as sorted numpy arrays. Evaluates scalars or whole frequency
+    vectors with np.interp and extrapolates linearly past both ends, like
+    interp1d(fill_value="extrapolate") did."""
+
+    def __init__(self, freq, val):
+        import numpy as np
+
+        order = np.argsort(freq, kind="stable")
+        self.freq = np.asarray(freq, dtype=float)[order]
+        self.val = np.asarray(val, dtype=float)[order]
+        if len(self.freq) < 2:
+            self.freq = np.array([0.0, 1.0]) if not len(self.freq) else np.repeat(self.freq, 2) + [0.0, 1.0]
+            self.val = np.zeros(2) if not len(self.val) else np.repeat(self.val, 2)
+        f, v = self.freq, self.val
+        self.slope = (
+            (v[1] - v[0]) / (f[1] - f[0]) if f[1] != f[0] else 0.0,
+            (v[-1] - v[-2]) / (f[-1] - f[-2]) if f[-1] != f[-2] else 0.0,
+        )
+
+    def __call__(self, freq):
+        import numpy as np
+
+        f = np.asarray(freq, dtype=float)
+        y = np.interp(f, self.freq, self.val)
+        y = np.where(f < self.freq[0], self.val[0] + (f - self.freq[0]) * self.slope[0], y)
+        y = np.where(f > self.freq[-1], self.val[-1] + (f - self.freq[-1]) * self.slope[1], y)
+        return float(y) if y.ndim == 0 else y
+
+
+class SampleStore(object):
+    """Growable float64 columns for streamed samples (DMM readings, PSU I/V pairs, ...).
+    append() is amortized O(1); readers get copies of what has been recorded so far, so a
+    logging thread can keep filling the store while the UI reads or saves it."""
+
+    def __init__(self, names, capacity=1024):
+        import numpy as np
+
+        self.names = list(names)
+        self.data = np.zeros((capacity, len(self.names)))
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, *values):
+        with self.lock:
+            if self.count == len(self.data):
+                import numpy as np
+
+                self.data = np.concatenate((self.data, np.zeros_like(self.data)))
+            self.data[self.count] = values
+            self.count += 1
+
+    def column(self, name):
+        with self.lock:
+            return self.data[: self.count, self.names.index(name)].copy()
+
+    def columns(self):
+        with self.lock:
+            return {nm: self.data[: self.count, k].copy() for k, nm in enumerate(self.names)}
+
+
 class bATEinst_base(object):
     Equip_Type = "None"
     Model_Supported = ["None"]
@@ -16,11 +85,32 @@ class bATEinst_base(object):
     isRunning = False
     RequestStop = False
     VisaRM = None
+    Cal_Cache = {}
+
+    SYNC_OPC = "OPC?"
+    SYNC_DEFER = "DEFER"
+    SYNC_SRQ = "SRQ"
+
+    ERR_CHECK_NEVER = "NEVER"
+    ERR_CHECK_BATCH = "BATCH"
+    ERR_CHECK_EVERY = "EVERY"
+    Err_Query = "SYST:ERR?"
+    Err_Queue_Max = 32
+    Read_Piece = 1 << 20
 
     def __init__(self, name=""):
         self.Name = name
         self.VisaAddress = None
         self.Inst = None
+        self.sync_mode = self.SYNC_OPC
+        self.sync_pending = False
+        self.srq_inst = None
+        self.err_check = self.ERR_CHECK_NEVER
+        self.err_check_every = 10
+        self.err_window = []
+        self.last_errors = []
+        self.io_lock = threading.RLock()
+        self.worker = None
 
     def __del__(self):
         self.close()
@@ -74,12 +164,22 @@ class bATEinst_base(object):
 
     def close(self):
         try:
+            if self.worker:
+                self.worker.shutdown(wait=True)
+                self.worker = None
             if self.Inst:
                 self.inst_close()
         except Exception:
             pass
         self.Inst = None
 
+    def submit(self, func, *args, **kwargs):
+        """Run func on this instrument's own worker thread and return the Future;
+        io_lock keeps it from interleaving with calls made from other threads."""
+        if not self.worker:
+            self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inst_%s" % self.Name)
+        return self.worker.submit(func, *args, **kwargs)
+
     def read(self):
         self.check_open()
         try:
@@ -100,29 +200,230 @@ class bATEinst_base(object):
             self.set_error("Write error\n info:" + str(e))
 
     def query(self, ss):
-        self.write(ss)
-        return self.read()
+        with self.io_lock:
+            self.write(ss)
+            return self.read()
+
+    def write_raw(self, vv):
+        self.check_open()
+        if isinstance(vv, list):
+            vv = bytes(vv)
+        self.Inst.write_raw(vv)
+
+    def read_raw(self, n):
+        self.check_open()
+        return self.Inst.read_bytes(n)
+
+    def read_raw_into(self, buf):
+        """Fill a writable buffer (bytearray, numpy slice, memoryview) from the session.
+        Uses the transport's readinto when it has one, else reads Read_Piece sized pieces
+        straight into place, so no copy of the whole transfer is ever built."""
+        self.check_open()
+        view = memoryview(buf).cast("B")
+        readinto = getattr(self.Inst, "readinto", None)
+        pos = 0
+        while pos < len(view):
+            if readinto:
+                n = readinto(view[pos:])
+            else:
+                dd = self.Inst.read_bytes(min(len(view) - pos, self.Read_Piece))
+                n = len(dd)
+                view[pos : pos + n] = dd
+            if not n:
+                self.set_error("Equip read error: %d of %d bytes received" % (pos, len(view)))
+            pos += n
+        return pos
+
+    def write_block(self, v, cmd=""):
+        # cmd followed by v as one IEEE 488.2 definite-length block, v is bytes or any buffer
+        v = memoryview(v).cast("B")
+        with self.io_lock:
+            self.write_raw(cmd.encode() + ("#8%08d" % len(v)).encode() + v.tobytes())
+
+    def read_block_header(self, cmd=None):
+        # "#<n><n digits of length>" of an IEEE 488.2 definite-length block, returns the length
+        if cmd:
+            self.write(cmd)
+        ss = self.read_raw(2)
+        if ss[0] != b"#"[0]:
+            self.set_error("Equip read block error")
+        sz = self.read_raw(int(ss[1]) - 48)
+        return int(bytes(sz).decode())
+
+    def read_block(self, cmd=None):
+        with self.io_lock:
+            return self.read_raw(self.read_block_header(cmd))
+
+    def read_block_into(self, buf, cmd=None):
+        with self.io_lock:
+            n = self.read_block_header(cmd)
+            view = memoryview(buf).cast("B")
+            if n > len(view):
+                self.set_error("Equip read block error: %d bytes for a %d byte buffer" % (n, len(view)))
+            return self.read_raw_into(view[:n])
+
+    def read_block_to(self, fid, cmd=None, piece=None):
+        """Copy a definite-length block to a binary file object through one reused
+        buffer of `piece` bytes (default Read_Piece); returns the block length."""
+        with self.io_lock:
+            n = self.read_block_header(cmd)
+            view = memoryview(bytearray(min(n, piece or self.Read_Piece)))
+            left = n
+            while left:
+                k = min(left, len(view))
+                self.read_raw_into(view[:k])
+                fid.write(view[:k])
+                left -= k
+            return n
 
     def delay(self, sec):
         time.sleep(sec)
 
+    # fn_relative change the fn to path related to the current path (or the exe when frozen)
+    def fn_relative(self, fn, sub_folder=None):
+        if os.path.isabs(fn):
+            return fn
+        if getattr(sys, "frozen", False):
+            hd = os.path.dirname(sys.executable)
+        else:
+            hd = os.path.dirname(os.path.realpath(__file__))
+        fn_full = os.path.realpath(os.path.join(hd, fn) if sub_folder is None else os.path.join(hd, sub_folder, fn))
+        os.makedirs(os.path.dirname(fn_full), exist_ok=True)
+        return fn_full
+
+    def load_cal_cable_loss(self, fn, freq_unit_rate=1e6, domain="V"):
+        """CalTable from a tab separated "freq<TAB>loss dB" file in calibration/, or a constant
+        loss when fn is a number. Tables are cached by path and mtime, so repeated loads are free.
+        freq_unit_rate: unit of the file frequencies (1e6 or "MHz" default, "KHz", "Hz")
+        domain: "V" converts the dB loss to a linear voltage ratio, anything else keeps dB"""
+        if isinstance(freq_unit_rate, str):
+            freq_unit_rate = {"MHz": 1e6, "KHz": 1e3, "Hz": 1}[freq_unit_rate]
+        try:
+            loss = float(fn)
+        except (TypeError, ValueError):
+            loss = None
+        if loss is not None:
+            return CalTable([0, 1e9], [loss] * 2)
+        fn = self.fn_relative(fn, "calibration")
+        st = os.stat(fn)
+        key = (fn, st.st_mtime_ns, st.st_size, freq_unit_rate, domain)
+        tab = bATEinst_base.Cal_Cache.get(key)
+        if tab is None:
+            import numpy as np
+
+            xys = np.loadtxt(fn, delimiter="\t", usecols=(0, 1), ndmin=2)
+            loss = 10 ** (xys[:, 1] / 20) if domain == "V" else xys[:, 1]
+            tab = CalTable(xys[:, 0] * freq_unit_rate, loss)
+            bATEinst_base.Cal_Cache = {k: v for k, v in bATEinst_base.Cal_Cache.items() if k[0] != fn}
+            bATEinst_base.Cal_Cache[key] = tab
+        return tab
+
+    def sync(self, timeout=None):
+        """Wait once for every operation issued since the last sync point.
+        timeout in seconds, None keeps the session timeout."""
+        if not self.sync_pending:
+            return
+        self.sync_pending = False
+        if self.sync_mode == self.SYNC_SRQ and self.wait_srq(timeout):
+            return
+        self.query("*OPC?")
+
+    def wait_srq(self, timeout=None):
+        # *OPC sets ESR bit 0 -> ESB (STB bit 5) -> service request; returns False when
+        # the session has no SRQ support (serial, sockets) so the caller falls back to *OPC?
+        inst = self.check_open()
+        try:
+            if self.srq_inst is not inst:
+                inst.enable_event(pyconst.EventType.service_request, pyconst.EventMechanism.queue)
+                inst.write("*ESE 1")
+                inst.write("*SRE 32")
+                self.srq_inst = inst
+        except Exception:
+            return False
+        try:
+            inst.write("*OPC")
+            inst.wait_on_event(
+                pyconst.EventType.service_request, inst.timeout if timeout is None else int(timeout * 1000)
+            )
+            inst.read_stb()
+            inst.query("*ESR?")
+        except Exception as e:
+            self.set_error("SRQ sync error\n info:" + str(e))
+        return True
+
+    @contextmanager
+    def deferred_sync(self, mode=SYNC_DEFER, timeout=None):
+        """Inside the block "*OPC?" lines of x_write are not sent; a single
+        completion wait (plain *OPC? or SRQ event) is done on exit."""
+        if self.sync_mode != self.SYNC_OPC:
+            # nested block, the outermost one does the wait
+            yield self
+            return
+        prev = self.sync_mode
+        self.sync_mode = mode
+        try:
+            yield self
+            self.sync(timeout)
+        finally:
+            self.sync_mode = prev
+
+    def set_error_check(self, policy=ERR_CHECK_BATCH, every=None):
+        """NEVER, BATCH (one SYST:ERR? drain at the end of each x_write) or
+        EVERY (drain after every `every` commands)."""
+        self.err_check = policy
+        if every:
+            self.err_check_every = every
+        self.err_window = []
+
+    def err_source(self, code, ss, cmds):
+        # best guess of the command(s) behind an error: the header quoted in the
+        # message, else the queries for query errors, else the whole window
+        detail = ss.rsplit(";", 1)[1].strip(' "').upper() if ";" in ss else ""
+        cands = [c for c in cmds if detail and detail in c.upper()]
+        if not cands and -499 <= code <= -400:
+            cands = [c for c in cmds if "?" in c]
+        return cands or cmds
+
+    def check_errors(self):
+        cmds, self.err_window = self.err_window, []
+        errs = []
+        for _ in range(self.Err_Queue_Max):
+            ss = self.query(self.Err_Query).strip()
+            rr = re.match(r"([+-]?\d+)", ss)
+            if not rr or int(rr.group(1)) == 0:
+                break
+            errs.append((int(rr.group(1)), ss, self.err_source(int(rr.group(1)), ss, cmds)))
+        self.last_errors = errs
+        if errs:
+            self.set_error("SCPI error\n" + "\n".join("%s <- %s" % (ss, " | ".join(src)) for code, ss, src in errs))
+        return errs
+
     def x_write(self, vvs, chx=""):
-        if isinstance(vvs, str):
-            vvs = vvs.splitlines()
-        res = []
-        for cc in vvs:
-            cc = cc.strip()
-            if not cc:
-                continue
-            cc = cc.replace("$CHX$", chx)
-            if re.match(r"\$WAIT *= *(\d+) *\$", cc):
-                self.delay(int(re.match(r"\$WAIT *= *(\d+) *\$", cc).group(1)) / 1000)
-            else:
-                if "?" in cc:
-                    res.append(self.query(cc))
+        with self.io_lock:
+            if isinstance(vvs, str):
+                vvs = vvs.splitlines()
+            res = []
+            for cc in vvs:
+                cc = cc.strip()
+                if not cc:
+                    continue
+                cc = cc.replace("$CHX$", chx)
+                if re.match(r"\$WAIT *= *(\d+) *\$", cc):
+                    self.delay(int(re.match(r"\$WAIT *= *(\d+) *\$", cc).group(1)) / 1000)
+                elif cc.upper() == "*OPC?" and self.sync_mode != self.SYNC_OPC:
+                    self.sync_pending = True
                 else:
-                    self.write(cc)
-        return res
+                    if "?" in cc:
+                        res.append(self.query(cc))
+                    else:
+                        self.write(cc)
+                    if self.err_check != self.ERR_CHECK_NEVER:
+                        self.err_window.append(cc)
+                        if self.err_check == self.ERR_CHECK_EVERY and len(self.err_window) >= self.err_check_every:
+                            self.check_errors()
+            if self.err_check == self.ERR_CHECK_BATCH and self.err_window:
+                self.check_errors()
+            return res
 
 
 class instMultimeter(bATEinst_base):
@@ -137,6 +438,9 @@ class instMultimeter(bATEinst_base):
     MM_AC = "AC"
     MM_DC = "DC"
 
+    MM_FUNC = {"V": "VOLT", "I": "CURR", "R": "RES", "R4": "FRES"}
+    MM_FUNC_NO_AC_DC = ("RES", "FRES")
+
     def __init__(self, name=""):
         super().__init__(name)
         self.current_mode = None
@@ -162,6 +466,15 @@ class instMultimeter(bATEinst_base):
     def measure_quick(self):
         return self.measure()
 
+    def arm(self):
+        self.x_write(["INIT"])
+
+    def fetch(self):
+        return float(self.x_write(["FETC?"])[0])
+
+    def abort(self):
+        self.x_write(["ABOR"])
+
     def measure_i(self):
         self.set_mode(self.MM_MODE_I)
         return self.measure()
@@ -174,6 +487,72 @@ class instMultimeter(bATEinst_base):
         self.set_mode(self.MM_MODE_R)
         return self.measure()
 
+    def scan_point(self, mode=MM_MODE_V, ac_dc=MM_AC, rng=MM_RANGE_AUTO):
+        mode = self.MM_FUNC.get(mode, mode)
+        ac_dc = None if mode in self.MM_FUNC_NO_AC_DC else ac_dc
+        return (mode, ac_dc, str(rng))
+
+    def configure(self, mode=MM_MODE_V, ac_dc=MM_AC, rng=MM_RANGE_AUTO):
+        """Configure function/range, sending only what differs from the cached state.
+        Returns True if anything was sent to the meter."""
+        mode, ac_dc, rng = self.scan_point(mode, ac_dc, rng)
+        func = mode if ac_dc is None else f"{mode}:{ac_dc}"
+        if (mode, ac_dc) != (self.current_mode, self.current_ac_dc):
+            self.x_write([f"CONF:{func} {rng}", "*OPC?"])
+        elif rng != str(self.current_range):
+            if rng.upper() == self.MM_RANGE_AUTO:
+                self.x_write([f"SENS:{func}:RANG:AUTO ON", "*OPC?"])
+            else:
+                self.x_write([f"SENS:{func}:RANG {rng}", "*OPC?"])
+        else:
+            return False
+        self.current_mode = mode
+        self.current_ac_dc = ac_dc
+        self.current_range = rng
+        return True
+
+    def scan_order(self, points):
+        """Visit order (indexes into points) grouping points of the same function,
+        so each function/AC-DC switch is paid once per pass."""
+        keys = [self.scan_point(*p) for p in points]
+        order = sorted(range(len(keys)), key=lambda k: (keys[k][0], str(keys[k][1]), keys[k][2]))
+        cur = (self.current_mode, self.current_ac_dc, str(self.current_range))
+        if keys and cur in keys and keys[order[-1]] == cur:
+            order.reverse()
+        return order
+
+    def scan(self, points, repeats=1, interval=0):
+        """Measure a list of (function, AC/DC, range) points repeatedly.
+
+        Passes start every `interval` seconds (deadline scheduled) and alternate
+        direction, so the last point of a pass is the first of the next and needs
+        no reconfiguration. Returns a numpy structured array with a "time" column
+        (pass start, s) and one column per point, in the order given."""
+        import numpy as np
+
+        points = [p if isinstance(p, (list, tuple)) else (p,) for p in points]
+        keys = [self.scan_point(*p) for p in points]
+        names = []
+        for mode, ac_dc, rng in keys:
+            nm = "_".join([mode] + ([ac_dc] if ac_dc else []) + [rng])
+            while nm in names:
+                nm += "_"
+            names.append(nm)
+        res = np.full(repeats, np.nan, dtype=[("time", "f8")] + [(nm, "f8") for nm in names])
+        order = self.scan_order(points)
+        t0 = time.time()
+        for rep in range(repeats):
+            if self.RequestStop:
+                return res[:rep]
+            wait = t0 + rep * interval - time.time()
+            if wait > 0:
+                self.delay(wait)
+            res["time"][rep] = time.time() - t0
+            for k in order if rep % 2 == 0 else reversed(order):
+                self.configure(*keys[k])
+                res[names[k]][rep] = float(self.x_write(["READ?"])[0])
+        return res
+
 
 class instKS_34461A(instMultimeter):
     def __init__(self, name="", visa_address=""):
@@ -182,3 +561,29 @@ class instKS_34461A(instMultimeter):
         self.sleep_time = None
         self.time_dur = None
         self.time_dur_unit = None
+        self.stats_count = None
+
+    def set_statistics(self, count=None):
+        """Take `count` readings per trigger and reduce them in the meter (CALC:AVER).
+        Call after set_mode/set_range, CONF resets it. None or 1 turns it off."""
+        if count and int(count) > 1:
+            self.x_write([f"SAMP:COUN {int(count)}", "CALC:AVER:STAT ON", "*OPC?"])
+            self.stats_count = int(count)
+        else:
+            self.x_write(["SAMP:COUN 1", "CALC:AVER:STAT OFF", "*OPC?"])
+            self.stats_count = None
+
+    def arm(self):
+        if self.stats_count:
+            self.x_write(["CALC:AVER:CLE", "INIT"])
+        else:
+            super().arm()
+
+    def fetch_stats(self):
+        # only the summary crosses the bus, the raw block stays in reading memory
+        mean, sdev, vmin, vmax = [float(k) for k in self.x_write(["*OPC?", "CALC:AVER:ALL?"])[-1].split(",")]
+        return {"mean": mean, "sdev": sdev, "min": vmin, "max": vmax, "count": self.stats_count}
+
+    def measure_stats(self):
+        self.arm()
+        return self.fetch_stats()
@@ -8,7 +8,7 @@ import tkinter as tk
 import tkinter.font as font
 from tkinter import ttk, filedialog, scrolledtext
 
-from dmm_driver import instKS_34461A
+from dmm_driver import instKS_34461A, SampleStore
 
 
 class TerminalRedirector:
@@ -33,6 +33,8 @@ class UI(tk.Tk):
     data_type_time_dur_unit = "时长单位"
     data_type_usb_lan = "USB/LAN"
     data_type_visa_address = "Visa Address"
+    data_type_double_buffer = "双缓冲采集"
+    data_type_stats_block = "仪表统计块"
     data_type_user_input_btn_process = "结束"
 
     user_input_non_positive_alert = "请输入正数！！！"
@@ -62,6 +64,8 @@ class UI(tk.Tk):
     lable_for_visa_address = "请输入设备visa地址"
     lable_for_ip_address = "请输入设备ip地址   "
     label_for_filedialog_title = "选择保存路径和文件名"
+    lable_for_double_buffer = "双缓冲采集(仪表积分与数据处理并行)"
+    lable_for_stats_block = "仪表内统计: 每块读数个数(留空保存原始读数)"
 
     AC = "AC"
     DC = "DC"
@@ -290,6 +294,24 @@ class UI(tk.Tk):
         self.txt_sleep = tk.Text(self.frame_sleep, width=10, height=1)
         self.txt_sleep.pack(side=tk.LEFT, padx=5)
 
+        self.var_double_buffer = tk.BooleanVar(value=False)
+        self.ck_btn_double_buffer = tk.Checkbutton(
+            self.frame_sleep,
+            text=self.lable_for_double_buffer,
+            variable=self.var_double_buffer,
+            command=lambda: self.show_selected(self.data_type_double_buffer),
+        )
+        self.ck_btn_double_buffer.pack(side=tk.LEFT, padx=5)
+
+        self.lb_stats_block = tk.Label(self, text=self.lable_for_stats_block)
+        self.lb_stats_block.pack(pady=10, anchor=tk.W)
+
+        self.frame_stats_block = tk.Frame(self)
+        self.frame_stats_block.pack(pady=5, anchor=tk.W)
+
+        self.txt_stats_block = tk.Text(self.frame_stats_block, width=10, height=1)
+        self.txt_stats_block.pack(side=tk.LEFT, padx=5)
+
         self.lb_time_dur = tk.Label(self, text=self.lable_for_time_dur_input)
         self.lb_time_dur.pack(pady=10, anchor=tk.W)
 
@@ -437,6 +459,9 @@ class UI(tk.Tk):
         elif data_type == self.data_type_usb_lan:
             var = self.usb_lan.get()
             self.lb_show_selected.config(text=f"{self.lable_for_show_selection}{var}")
+        elif data_type == self.data_type_double_buffer:
+            var = self.lable_for_double_buffer if self.var_double_buffer.get() else "单次采集"
+            self.lb_show_selected.config(text=f"{self.lable_for_show_selection}{var}")
         elif data_type == self.data_type_visa_address:
             var_usb = self.var_usb_visa_address.get().replace(" ", "")
             var_lan = (
@@ -486,6 +511,11 @@ class UI(tk.Tk):
             return self.var_time_dur_unit.get()
         elif data_type == self.data_type_visa_address:
             return self.var_visa_address
+        elif data_type == self.data_type_double_buffer:
+            return self.var_double_buffer.get()
+        elif data_type == self.data_type_stats_block:
+            var = self.txt_stats_block.get("1.0", tk.END).strip()
+            return int(var) if var.isdigit() and int(var) > 1 else None
 
     def cal_run_time(self, time_unit, time_dur):
         time_in_second = 0
@@ -517,12 +547,16 @@ class UI(tk.Tk):
             self.saved_sleep_time = self.get_data(UI.data_type_sleep_time)
             self.saved_time_dur = self.get_data(UI.data_type_time_dur)
             self.saved_time_dur_unit = self.get_data(UI.data_type_time_dur_unit)
+            self.saved_double_buffer = self.get_data(UI.data_type_double_buffer)
+            self.saved_stats_block = self.get_data(UI.data_type_stats_block)
 
             mt = instKS_34461A(visa_address=self.saved_visa_address)
             mt.inst_open()
 
             mt.set_mode(self.saved_mode_input, self.saved_ac_dc_input)
             mt.set_range(self.saved_range_input)
+            if self.saved_stats_block:
+                mt.set_statistics(self.saved_stats_block)
 
             print("主程序开始处理")
 
@@ -533,14 +567,21 @@ class UI(tk.Tk):
 
             count = 0
 
-            self.time_stamps = []
-            self.power_data = []
+            names = ["time_stamps", "power"]
+            if self.saved_stats_block:
+                names += ["power_min", "power_max", "power_sdev"]
+            self.samples = SampleStore(names)
 
             self.time_stamps_path = None
             self.power_data_path = None
 
             is_delete_first_measure = False
 
+            # Double buffering: re-arm right after each fetch so the host work overlaps the next integration
+            if self.saved_double_buffer:
+                mt.arm()
+                armed_time = time.time()
+
             while True:
                 time_since_start = time.time() - start_time
                 if time_since_start >= total_runtime or self.is_terminated:
@@ -551,10 +592,20 @@ class UI(tk.Tk):
                 if count - 100 >= 0 and count % 100 == 0:
                     self.save_mat_file()
 
-                self.time_stamps.append(time_since_start)
-                self.time_measure_start = time.time()
-                power = mt.measure()
-                self.power_data.append(power)
+                if self.saved_double_buffer:
+                    power = mt.fetch_stats() if self.saved_stats_block else mt.fetch()
+                    time_stamp = armed_time - start_time
+                    mt.arm()
+                    armed_time = self.time_measure_start = time.time()
+                else:
+                    time_stamp = time_since_start
+                    self.time_measure_start = time.time()
+                    power = mt.measure_stats() if self.saved_stats_block else mt.measure()
+                if self.saved_stats_block:
+                    self.samples.append(time_stamp, power["mean"], power["min"], power["max"], power["sdev"])
+                    power = power["mean"]
+                else:
+                    self.samples.append(time_stamp, power)
                 count += 1
                 current_time = datetime.now().strftime("%m.%d %H:%M:%S")
                 self.update()
@@ -573,6 +624,8 @@ class UI(tk.Tk):
             self.btn_exit.pack(side=tk.LEFT, padx=5)
             self.btn_terminate_test.pack_forget()
 
+            if self.saved_double_buffer:
+                mt.abort()
             mt.close()
 
     def terminate(self):
@@ -605,8 +658,6 @@ class UI(tk.Tk):
             time.sleep(interval)
 
     def save_mat_file(self):
-        mat_var_time_stamps = "time_stamps"
-        mat_var_power = "power"
         mat_var_config = "configuration"
 
         config = [
@@ -616,15 +667,14 @@ class UI(tk.Tk):
             f"{self.data_type_range}: " + self.saved_range_input,
             f"{self.data_type_sleep_time}: " + str(self.saved_sleep_time) + self.default_time_dur_unit,
             f"{self.data_type_time_dur}: " + str(self.saved_time_dur) + self.saved_time_dur_unit,
+            f"{self.data_type_double_buffer}: " + str(self.saved_double_buffer),
+            f"{self.data_type_stats_block}: " + str(self.saved_stats_block),
             "开始时间: " + self.time_start,
             "保存时间: " + datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         ]
 
-        data_to_save = {
-            mat_var_time_stamps: list(self.time_stamps),
-            mat_var_power: list(self.power_data),
-            mat_var_config: list(config),
-        }
+        data_to_save = self.samples.columns()
+        data_to_save[mat_var_config] = list(config)
 
         # Delegated to driver layer (may use scipy/numpy internally if available)
         if hasattr(instKS_34461A, "save_matfile"):
@@ -3,20 +3,200 @@ Legacy instrument drivers (oscilloscopes / AWGs / power supplies / switches / SG
 Kept separate so the main multimeter tool chain (dmm_driver + dmm_ui) stays lightweight.
 """
 
+import hashlib
+import json
 import math
+import os
+import queue
 import struct
+import threading
 import time
 import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import numpy as np
 import serial
 import matplotlib.pyplot as plt
 from scipy.io import savemat
-import scipy.interpolate as intpl
+import pyvisa as visa
 from pyvisa import constants as pyconst
 
-from dmm_driver import bATEinst_base
+from dmm_driver import bATEinst_base, bATEinst_Exception, SampleStore
+
+
+def save_columns(fn, data, names, header=False):
+    """Save a 2-D array (one column per name) by extension: .npy, .mat or tab-separated text
+    (names as the first line when header is set; object arrays are written with %s)."""
+    ext = os.path.splitext(fn)[1].lower()
+    if ext == ".npy":
+        np.save(fn, data)
+    elif ext == ".mat":
+        savemat(fn, {nm: data[:, k] for k, nm in enumerate(names)}, appendmat=False)
+    else:
+        fmt = "\t".join(["%s" if data.dtype == object else "%g"] * data.shape[1]) + "\n"
+        with open(fn, "wt") as fid:
+            if header:
+                fid.write("\t".join(names) + "\n")
+            for k in range(0, len(data), 65536):
+                blk = data[k : k + 65536]
+                fid.write((fmt * len(blk)) % tuple(blk.ravel().tolist()))
+
+
+# Binary waveform file (instOSC_MDO34.save_waveform), all fields little endian:
+#   head    8s magic b"BWFM\x00\x00\x00\x02" | H channel count | 6s numpy dtype string ("|i1") | Q header length
+#   nch x   H channel | Q points | d x_inc | d x_off | d y_inc | d y_off
+#   data    the raw samples of every channel back to back, in table order, starting at header length
+# time = x_off + k * x_inc, volts = raw * y_inc + y_off, y_off in volts (Tek: YZERO - YOFF * YMULT).
+# Files from the old writer (5 doubles n, x_inc, x_off, y_inc, y_off then int8 samples of CH1) still load
+# with that same raw * y_inc + y_off reading; their y_off is the raw Tek YOFF, so volts are only right
+# when the channel had no vertical offset.
+WFM_MAGIC = b"BWFM\x00\x00\x00\x02"
+WFM_HEAD = struct.Struct("<8sH6sQ")
+WFM_CHAN = struct.Struct("<HQdddd")
+WFM_LEGACY_HEAD = struct.Struct("5d")
+
+
+class WaveformView(object):
+    """Raw samples plus scale factors, volts are only computed for what is indexed
+    (in `dtype`, float32 halves the memory of float64). min/max/mean/std/rms work
+    on the raw integers and never build the float array."""
+
+    def __init__(self, raw, y_inc, y_off, x_inc=1.0, x_off=0.0, dtype=np.float64):
+        self.raw = raw
+        self.y_inc = y_inc
+        self.y_off = y_off
+        self.x_inc = x_inc
+        self.x_off = x_off
+        self.dtype = np.dtype(dtype)
+        self.moments = None
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __getitem__(self, idx):
+        vv = np.multiply(self.raw[idx], self.y_inc, dtype=self.dtype)
+        vv += self.dtype.type(self.y_off)
+        return vv
+
+    def astype(self, dtype):
+        return WaveformView(self.raw, self.y_inc, self.y_off, self.x_inc, self.x_off, dtype)
+
+    def window(self, idx):
+        """View of a slice of the samples (no copy for plain slices), time axis kept."""
+        st = idx.indices(len(self.raw))[0] if isinstance(idx, slice) else 0
+        return WaveformView(self.raw[idx], self.y_inc, self.y_off, self.x_inc, self.x_off + st * self.x_inc, self.dtype)
+
+    def raw_moments(self):
+        # (n, min, max, sum, sum of squares) of the raw codes; 8-bit data goes through a
+        # 256-bin histogram so the whole capture is reduced in one integer pass
+        if self.moments is None:
+            raw = np.asarray(self.raw)
+            if raw.dtype.itemsize == 1:
+                cnt = np.bincount(raw.view(np.uint8), minlength=256)
+                lv = np.arange(256, dtype=np.uint8).view(raw.dtype).astype(np.int64)
+                used = lv[cnt > 0]
+                self.moments = (
+                    len(raw),
+                    int(used.min()) if len(used) else 0,
+                    int(used.max()) if len(used) else 0,
+                    int(np.dot(cnt, lv)),
+                    int(np.dot(cnt, lv * lv)),
+                )
+            else:
+                s1 = s2 = 0
+                for k in range(0, len(raw), 1 << 20):
+                    blk = raw[k : k + (1 << 20)].astype(np.int64)
+                    s1 += int(blk.sum())
+                    s2 += int(np.dot(blk, blk))
+                self.moments = (len(raw), int(raw.min()), int(raw.max()), s1, s2)
+        return self.moments
+
+    def min(self):
+        n, lo, hi, s1, s2 = self.raw_moments()
+        return min(lo * self.y_inc, hi * self.y_inc) + self.y_off
+
+    def max(self):
+        n, lo, hi, s1, s2 = self.raw_moments()
+        return max(lo * self.y_inc, hi * self.y_inc) + self.y_off
+
+    def mean(self):
+        n, lo, hi, s1, s2 = self.raw_moments()
+        return s1 / n * self.y_inc + self.y_off
+
+    def std(self):
+        n, lo, hi, s1, s2 = self.raw_moments()
+        return abs(self.y_inc) * math.sqrt(max(s2 / n - (s1 / n) ** 2, 0.0))
+
+    def rms(self):
+        n, lo, hi, s1, s2 = self.raw_moments()
+        g, o = self.y_inc, self.y_off
+        return math.sqrt(max(g * g * s2 / n + 2 * g * o * s1 / n + o * o, 0.0))
+
+    def time(self, idx=slice(None)):
+        kk = np.arange(*idx.indices(len(self.raw))) if isinstance(idx, slice) else np.asarray(idx)
+        return kk * self.x_inc + self.x_off
+
+
+def waveform_view(raw, scale=None, dtype=np.float64, ch=None):
+    """WaveformView over a read_waveform dict (channel ch, or its default channel)
+    or over raw codes with a [yinc, yor, yref] scale; nothing is converted yet."""
+    xscale = [1.0, 0.0, 0.0]
+    if isinstance(raw, dict):
+        xscale = np.ravel(raw.get("xscale", xscale))
+        scale = np.ravel(raw["scale"] if ch is None else raw[f"ch{ch}scale"])
+        raw = raw["data"] if ch is None else raw[f"ch{ch}data"]
+    return WaveformView(
+        np.ravel(raw),
+        float(scale[0]),
+        -float(scale[1] + scale[2]) * float(scale[0]),
+        float(xscale[0]),
+        -float(xscale[1] + xscale[2]) * float(xscale[0]),
+        dtype,
+    )
+
+
+def backoff(first, last, factor=2.0):
+    """Poll intervals growing geometrically from first to last (s)."""
+    dt = first
+    while True:
+        yield dt
+        dt = min(dt * factor, last)
+
+
+def write_wfm_header(fid, dtype, chans):
+    """chans: list of (channel, points, x_inc, x_off, y_inc, y_off)."""
+    dtype = np.dtype(dtype).str.encode()
+    fid.write(WFM_HEAD.pack(WFM_MAGIC, len(chans), dtype, WFM_HEAD.size + WFM_CHAN.size * len(chans)))
+    for cc in chans:
+        fid.write(WFM_CHAN.pack(*cc))
+
+
+def load_wfm(fn):
+    """Open a binary waveform file as {channel: WaveformView} over np.memmap views."""
+    size = os.path.getsize(fn)
+    with open(fn, "rb") as fid:
+        head = fid.read(WFM_HEAD.size)
+        if len(head) == WFM_HEAD.size and head[:8] == WFM_MAGIC:
+            _, nch, dtype, hlen = WFM_HEAD.unpack(head)
+            if hlen != WFM_HEAD.size + WFM_CHAN.size * nch:
+                raise ValueError("%s: header length %d does not match %d channels" % (fn, hlen, nch))
+            chans = [WFM_CHAN.unpack(fid.read(WFM_CHAN.size)) for _ in range(nch)]
+            dtype = np.dtype(dtype.rstrip(b"\x00").decode())
+        else:
+            fid.seek(0)
+            n, x_inc, x_off, y_inc, y_off = WFM_LEGACY_HEAD.unpack(fid.read(WFM_LEGACY_HEAD.size))
+            hlen, dtype = WFM_LEGACY_HEAD.size, np.dtype(np.int8)
+            chans = [(1, int(n), x_inc, x_off, y_inc, y_off)]
+    if hlen + sum(cc[1] for cc in chans) * dtype.itemsize > size:
+        raise ValueError("%s: file is shorter than its header describes" % fn)
+    res = {}
+    pos = hlen
+    for ch, n, x_inc, x_off, y_inc, y_off in chans:
+        raw = np.memmap(fn, dtype, "r", pos, (n,)) if n else np.empty(0, dtype)
+        res[ch] = WaveformView(raw, y_inc, y_off, x_inc, x_off)
+        pos += n * dtype.itemsize
+    return res
 
 
 class instAWG(bATEinst_base):
@@ -50,7 +230,268 @@ class instAWG(bATEinst_base):
         self.set_offset(v)
 
 
-class instOSC_DS1104(bATEinst_base):
+class instOSC(bATEinst_base):
+    Equip_Type = "osc"
+    Chunk_Size = 125000
+    Chunk_Range = (":WAV:STAR %d", ":WAV:STOP %d")
+    Chunk_Data = ":WAV:DATA?"
+    Chunk_Sync = False
+    Pipeline_Depth = 8
+    Chunk_Candidates = (25000, 50000, 125000, 250000, 500000, 1000000)
+    Chunk_Tune_File = "osc_chunk.json"
+    Chunk_Tune_Margin = 4
+    Chunk_Tune_Min_Timeout = 2000
+    Chunk_Tune_Max_Timeout = 60000
+
+    def __init__(self, name="osc"):
+        super().__init__(name)
+        self.chunk_size = None
+        self.chunk_timeout = None
+        self.armed_count = None
+
+    Arm_Cmds = [":STOP", "*OPC?", ":SING"]
+    Trig_Query = ":TRIG:STAT?"
+    Trig_Done = "STOP"
+    Trig_Poll_Min = 0.001
+    Trig_Poll = 0.05
+    Arm_Window = 0.1
+    Acq_Count_Query = None
+    Acq_Count_Base = None
+    Disp_Query = ":CHAN%d:DISP?"
+
+    def wave_setup(self, ch):
+        """Select channel ch for raw byte transfer, return (points, preamble fields)."""
+        self.set_error("Function not implemented")
+
+    def save_image(self, fn):
+        self.set_error("Function not implemented")
+
+    def save_image_async(self, fn):
+        """Screenshot on the scope's worker thread, returns a Future (result: fn)."""
+        return self.submit(lambda: self.save_image(fn) or fn)
+
+    def arm(self):
+        # A fast capture may already be finished by the first poll and then reads exactly like
+        # the stopped state before arming. With an acquisition counter (Acq_Count_Query) a new
+        # capture is proven by the counter passing its value at arm time (Acq_Count_Base when
+        # arming restarts the counter). Without one, wait up to Arm_Window for the state to
+        # leave Trig_Done and take it as started after that.
+        if self.Acq_Count_Query:
+            self.armed_count = self.Acq_Count_Base if self.Acq_Count_Base is not None else self.acq_count()
+        self.x_write(self.Arm_Cmds)
+        if self.Acq_Count_Query:
+            return
+        st = time.time()
+        delays = backoff(self.Trig_Poll_Min, self.Trig_Poll)
+        while self.trig_state_done() and time.time() - st < self.Arm_Window:
+            self.delay(next(delays))
+
+    def acq_count(self):
+        return int(float(self.query(self.Acq_Count_Query)))
+
+    def trig_state_done(self):
+        return self.query(self.Trig_Query).strip().upper().startswith(self.Trig_Done)
+
+    def is_triggered(self):
+        if not self.trig_state_done():
+            return False
+        return not self.Acq_Count_Query or self.armed_count is None or self.acq_count() > self.armed_count
+
+    def wait_triggered(self, timeout=10):
+        st = time.time()
+        delays = backoff(self.Trig_Poll_Min, self.Trig_Poll)
+        while not self.is_triggered():
+            if time.time() - st > timeout:
+                self.set_error("trigger timeout after %.1fs" % timeout)
+            self.delay(next(delays))
+        return time.time() - st
+
+    def displayed_channels(self):
+        return [ch for ch in range(1, 5) if self.query(self.Disp_Query % ch).strip().startswith("1")]
+
+    def read_waveform(self, ch):
+        _, pre = self.wave_setup(ch)
+        ff, tt, point, count, xinc, xor, xref, yinc, yor, yref = [float(k) for k in pre]
+
+        mm = {
+            "xscale": [xinc, xor, xref],
+            "xinc": xinc,
+            "point": point,
+            "format": ff,
+            "count": count,
+            "type": tt,
+            "channels": [ch],
+            "time": str(datetime.fromtimestamp(time.time())),
+        }
+        yscale = [yinc, yor, yref]
+
+        mm[f"ch{ch}scale"] = yscale
+        ddar = np.empty(int(point), np.uint8)
+        ddar = ddar[: self.read_chunks_into(ddar, point)]
+        mm[f"ch{ch}data"] = ddar
+        mm["scale"] = yscale
+        mm["data"] = ddar
+        return mm
+
+    def scaled(self, raw, scale=None, dtype=np.float64, ch=None):
+        return waveform_view(raw, scale, dtype, ch)
+
+    def raw2float(self, raw, scale=None, dtype=np.float64, ch=None):
+        return self.scaled(raw, scale, dtype, ch)[:]
+
+    def read_waveforms(self, chs=None):
+        """read_waveform of every channel in chs (default: displayed ones) merged into one dict."""
+        chs = self.displayed_channels() if chs is None else list(chs)
+        mm = {}
+        for ch in chs:
+            mm.update(self.read_waveform(ch))
+        mm["channels"] = chs
+        mm.pop("scale", None)
+        mm.pop("data", None)
+        return mm
+
+    def load_chunk_tuning(self):
+        self.chunk_size = 0
+        try:
+            with open(self.fn_relative(self.Chunk_Tune_File, "calibration"), "rt") as fid:
+                tuned = json.load(fid).get(str(self.VisaAddress))
+        except (OSError, ValueError):
+            return
+        if tuned:
+            self.chunk_size = int(tuned["chunk"])
+            self.chunk_timeout = int(tuned["timeout"])
+            if self.Inst:
+                self.set_visa_timeout_value(self.chunk_timeout)
+
+    def save_chunk_tuning(self):
+        fn = self.fn_relative(self.Chunk_Tune_File, "calibration")
+        try:
+            with open(fn, "rt") as fid:
+                mm = json.load(fid)
+        except (OSError, ValueError):
+            mm = {}
+        mm[str(self.VisaAddress)] = {
+            "chunk": self.chunk_size,
+            "timeout": self.chunk_timeout,
+            "model": type(self).__name__,
+        }
+        with open(fn, "wt") as fid:
+            json.dump(mm, fid, indent=1)
+
+    def calibrate_chunk_size(self, ch=1, candidates=None, repeat=3, save=True):
+        """Time raw transfers of the current capture on channel ch for each candidate
+        chunk size, keep the fastest, and set VI_ATTR_TMO_VALUE to Chunk_Tune_Margin
+        times the expected duration of one chunk. The result is stored per VisaAddress
+        and used by read_waveform/save_waveform from then on."""
+        point, _ = self.wave_setup(ch)
+        rates = {}
+        self.check_open()
+        # apply any stored tuning first, so it cannot replace the timeouts set below mid-calibration
+        if self.chunk_size is None:
+            self.load_chunk_tuning()
+        old_timeout = self.Inst.get_visa_attribute(pyconst.VI_ATTR_TMO_VALUE)
+        tuned = False
+        try:
+            for size in candidates or self.Chunk_Candidates:
+                if size > point and rates:
+                    break
+                self.set_visa_timeout_value(self.Chunk_Tune_Max_Timeout)
+                st = time.perf_counter()
+                try:
+                    got = self.read_chunks(min(point, size * repeat), lambda pos, blk: None, size)
+                except (bATEinst_Exception, visa.VisaIOError):
+                    # chunk too large for this link/backend, drop whatever is left in the output queue
+                    try:
+                        self.Inst.clear()
+                    except Exception:
+                        pass
+                    continue
+                rates[size] = got / max(time.perf_counter() - st, 1e-6)
+            if not rates:
+                self.set_error("chunk size calibration failed for all candidates")
+            self.chunk_size = max(rates, key=rates.get)
+            self.chunk_timeout = int(
+                min(
+                    self.Chunk_Tune_Max_Timeout,
+                    max(
+                        self.Chunk_Tune_Min_Timeout,
+                        self.Chunk_Tune_Margin * self.chunk_size / rates[self.chunk_size] * 1000,
+                    ),
+                )
+            )
+            self.set_visa_timeout_value(self.chunk_timeout)
+            tuned = True
+        finally:
+            if not tuned:
+                self.set_visa_timeout_value(old_timeout)
+        if save:
+            self.save_chunk_tuning()
+        return {"chunk": self.chunk_size, "timeout": self.chunk_timeout, "rates": rates}
+
+    def chunk_ranges(self, point, size=None):
+        if size is None and self.chunk_size is None:
+            self.load_chunk_tuning()
+        size = size or self.chunk_size or self.Chunk_Size
+        point = int(point)
+        return [(st, min(st + size - 1, point)) for st in range(1, point + 1, size)]
+
+    def request_chunk(self, st, stop):
+        # range and data query go out as one compound command; Chunk_Sync restores
+        # the *OPC? round trip for instruments that need it between range and data
+        cmds = [self.Chunk_Range[0] % st, self.Chunk_Range[1] % stop]
+        if self.Chunk_Sync:
+            self.x_write(cmds + ["*OPC?"])
+            self.write(self.Chunk_Data)
+        else:
+            self.write(";".join(cmds + [self.Chunk_Data]))
+
+    def read_chunks_into(self, buf, point, size=None):
+        pos = 0
+        with self.io_lock:
+            for st, stop in self.chunk_ranges(point, size):
+                self.request_chunk(st, stop)
+                pos += self.read_block_into(buf[pos:])
+        return pos
+
+    def read_chunks(self, point, consumer, size=None, depth=None):
+        """Transfer `point` samples chunk by chunk and hand every block to
+        consumer(offset, block) on a worker thread, so scaling/writing of chunk k
+        overlaps the transfer of chunk k+1. Returns the number of bytes read."""
+        blocks = queue.Queue(depth or self.Pipeline_Depth)
+        err = []
+
+        def work():
+            while True:
+                item = blocks.get()
+                if item is None:
+                    return
+                if not err:
+                    try:
+                        consumer(*item)
+                    except Exception as e:
+                        err.append(e)
+
+        th = threading.Thread(target=work, daemon=True)
+        th.start()
+        pos = 0
+        try:
+            with self.io_lock:
+                for st, stop in self.chunk_ranges(point, size):
+                    if err:
+                        break
+                    self.request_chunk(st, stop)
+                    blk = self.read_block()
+                    blocks.put((pos, blk))
+                    pos += len(blk)
+        finally:
+            blocks.put(None)
+            th.join()
+        if err:
+            raise err[0]
+        return pos
+
+
+class instOSC_DS1104(instOSC):
     Model_Supported = ["DS1104"]
 
     def __init__(self):
@@ -90,58 +531,52 @@ class instOSC_DS1104(bATEinst_base):
         self.x_write([":LOAD:SET '%s'" % fn, "*OPC?"])
 
     def save_image(self, fn):
-        self.x_write([":STORage:IMAGe:TYPE PNG", "*OPC?"])
-        self.write(":DISPlay:DATA?")
-        dd = self.read_block()
-        with open(fn, "wb") as fid:
-            fid.write(dd)
+        with self.io_lock, open(fn, "wb") as fid:
+            self.x_write([":STORage:IMAGe:TYPE PNG", "*OPC?"])
+            self.read_block_to(fid, ":DISPlay:DATA?")
+
+    def wave_setup(self, ch):
+        self.x_write(
+            [
+                ":WAV:SOUR CHAN%d" % ch,
+                ":WAV:MODE RAW",
+                ":WAV:FORM BYTE",
+            ]
+        )
+        pre = self.x_write(":WAV:PRE?")[0].split(",")
+        return int(float(pre[2])), pre
 
     def save_waveform(self, fn):
-        res = [
-            k.strip() == "1"
-            for k in self.x_write([":CHAN1:DISP?", ":CHAN2:DISP?", ":CHAN3:DISP?", ":CHAN4:DISP?"])
-        ]
-        chs = []
-        for k in range(len(res)):
-            if res[k]:
-                chs.append(k + 1)
+        res = [k.strip() == "1" for k in self.x_write([":CHAN1:DISP?", ":CHAN2:DISP?", ":CHAN3:DISP?", ":CHAN4:DISP?"])]
+        chs = [k + 1 for k in range(len(res)) if res[k]]
         vvs = []
         for ch in chs:
-            self.x_write(
-                [
-                    ":WAV:SOUR CHAN%d" % ch,
-                    ":WAV:MODE RAW",
-                    ":WAV:FORM BYTE",
-                ]
-            )
-            point, av, xinc, xor, xref, yinc, yor, yref = [
-                float(k) for k in self.x_write(":WAV:PRE?")[0].split(",")[2:]
-            ]
-            dd = []
-            for st in range(1, int(point) + 1, 125000):
-                self.x_write(
-                    [
-                        ":WAV:STAR %d" % st,
-                        ":WAV:STOP %d" % (st + 125000 - 1 if point >= st + 125000 - 1 else point),
-                    ]
-                )
-                self.write(":WAV:DATA?")
-                dd += self.read_block()
-            vvs.append([(k - yor - yref) * yinc for k in dd])
+            _, pre = self.wave_setup(ch)
+            point, av, xinc, xor, xref, yinc, yor, yref = [float(k) for k in pre[2:]]
+            vv = np.empty(int(point))
+
+            def scale(pos, blk, vv=vv, yoff=yor + yref, yinc=yinc):
+                blk = np.frombuffer(blk, np.uint8)
+                np.multiply(blk - yoff, yinc, out=vv[pos : pos + len(blk)])
+
+            vvs.append(vv[: self.read_chunks(point, scale)])
         pp = min([len(k) for k in vvs])
-        with open(fn, "wt") as fid:
-            for tt in range(pp):
-                fid.write(
-                    "\t".join(
-                        ["%g" % ((tt - xor - xref) * xinc)]
-                        + ["%g" % vvs[k][tt] for k in range(len(chs))]
-                    )
-                    + "\n"
-                )
+        tt = (np.arange(pp) - (xor + xref)) * xinc
+        save_columns(fn, np.column_stack([tt] + [k[:pp] for k in vvs]), ["time"] + ["ch%d" % ch for ch in chs])
 
 
-class instOSC_MDO34(bATEinst_base):
+class instOSC_MDO34(instOSC):
     Model_Supported = ["MDO34"]
+    Chunk_Size = 200000
+    Chunk_Range = (":DAT:START %d", ":DAT:STOP %d")
+    Chunk_Data = ":CURV?"
+    Arm_Cmds = [":ACQ:STOPA SEQ", ":ACQ:STATE RUN"]
+    Trig_Query = ":ACQ:STATE?"
+    Trig_Done = "0"
+    # NUMACQ counts the acquisitions since ACQ:STATE RUN, so it restarts at 0 on every arm
+    Acq_Count_Query = ":ACQ:NUMACQ?"
+    Acq_Count_Base = 0
+    Disp_Query = ":SEL:CH%d?"
 
     def __init__(self):
         super().__init__("osc")
@@ -171,43 +606,62 @@ class instOSC_MDO34(bATEinst_base):
     def save_image(self, fn):
         self.x_write([":SAV:IMAG:FILEF PNG", "SAV:IMAG " + fn, "*OPC?"])
 
-    def save_waveform(self, fn):
+    def wave_setup(self, ch):
         self.x_write(
             [
                 ":WFMO:ENC BIN",
                 ":WFMO:BN_FMT RI",
                 ":WFMO:BYT_O MSB",
                 ":WFMO:BYT_N 1",
-                ":DAT:SOU CH1",
+                f":DAT:SOU CH{ch}",
                 ":DAT:START 1",
                 ":DAT:STOP 20000000",
                 "*OPC?",
             ]
         )
         pre = self.x_write(":WFMO?")[0].split(";")
-        n = int(pre[6])
-        x_inc = float(pre[10])
-        x_off = float(pre[11])
-        y_inc = float(pre[14])
-        y_off = float(pre[15])
-        n_block = 200000
+        return int(pre[6]), pre
+
+    def save_waveform(self, fn, chs=(1,)):
+        """Stream channels chs to fn in the binary waveform format, see load_wfm."""
+        chans = []
         with open(fn, "wb") as fid:
-            hd = struct.pack("5d", n, x_inc, x_off, y_inc, y_off)
-            fid.write(hd)
-            for k in range(1, n, n_block):
-                self.x_write(
-                    [
-                        ":DAT:START %d " % k,
-                        ":DAT:STOP %d" % (k + n_block - 1 if (k + n_block - 1) <= n else n),
-                        "*OPC?",
-                    ]
-                )
-                self.write("CURV?")
-                dd = self.read_block()
-                fid.write(dd)
+            write_wfm_header(fid, np.int8, [(0, 0, 0, 0, 0, 0)] * len(chs))
+            for ch in chs:
+                n, pre = self.wave_setup(ch)
+                n = self.read_chunks(n, lambda pos, blk: fid.write(blk))
+                x_inc, x_off, y_mult, y_off, y_zero = [float(pre[k]) for k in (10, 11, 14, 15, 16)]
+                chans.append((ch, n, x_inc, x_off, y_mult, y_zero - y_off * y_mult))
+            fid.seek(0)
+            write_wfm_header(fid, np.int8, chans)
 
+    @staticmethod
+    def load_waveform(fn):
+        return load_wfm(fn)
 
-class instOSC_DHO1204(bATEinst_base):
+    def read_waveform(self, ch):
+        n, pre = self.wave_setup(ch)
+        # Tek preamble: volts = (raw - YOFF) * YMULT + YZERO, YOFF in digitizer levels
+        x_inc, x_off, y_mult, y_off, y_zero = [float(pre[k]) for k in (10, 11, 14, 15, 16)]
+        # scales in the (raw - (s[1] + s[2])) * s[0] form of the Rigol preamble
+        yscale = [y_mult, y_off - y_zero / y_mult if y_mult else 0.0, 0.0]
+        mm = {
+            "xscale": [x_inc, -x_off / x_inc if x_inc else 0.0, 0.0],
+            "xinc": x_inc,
+            "point": n,
+            "channels": [ch],
+            "time": str(datetime.fromtimestamp(time.time())),
+        }
+        ddar = np.empty(n, np.int8)
+        ddar = ddar[: self.read_chunks_into(ddar, n)]
+        mm[f"ch{ch}scale"] = yscale
+        mm[f"ch{ch}data"] = ddar
+        mm["scale"] = yscale
+        mm["data"] = ddar
+        return mm
+
+
+class instOSC_DHO1204(instOSC):
     Model_Supported = ["DHO1204"]
 
     def __init__(self):
@@ -242,10 +696,9 @@ class instOSC_DHO1204(bATEinst_base):
         self.x_write([f":LOAD:SET '{fn}'", "*OPC?"])
 
     def save_image(self, fn):
-        self.x_write([":SAV:IMAG:FILEF PNG", "*OPC?"])
-        dd = self.read_block(":SAVE:IMAGe:DATA?")
-        with open(fn, "wb") as fid:
-            fid.write(dd)
+        with self.io_lock, open(fn, "wb") as fid:
+            self.x_write([":SAV:IMAG:FILEF PNG", "*OPC?"])
+            self.read_block_to(fid, ":SAVE:IMAGe:DATA?")
 
     def set_acquire(self, depth=None, mode=None):
         if depth:
@@ -253,30 +706,21 @@ class instOSC_DHO1204(bATEinst_base):
 
     def save_waveform(self, fn, waves=None):
         if waves is None:
-            chs = [
-                (ch + 1) if self.query(f":CHAN{ch+1}:DISP?").startswith("1") else None
-                for ch in range(4)
-            ]
-            chs = [k for k in chs if k]
-            mm = {}
-            for ch in chs:
-                wv = self.read_waveform(ch)
-                mm = {**mm, **wv}
-            mm["channels"] = chs
+            mm = self.read_waveforms()
         else:
             if isinstance(waves, dict):
                 mm = waves
             elif isinstance(waves, list):
                 mm = {}
                 for wv in waves:
-                    mm = {**mm, **wv}
+                    mm.update(wv)
                 chs = [k["channels"][0] for k in waves]
                 mm["channels"] = chs
         mm.pop("scale", None)
         mm.pop("data", None)
         savemat(fn, mm, appendmat=False)
 
-    def read_waveform(self, ch):
+    def wave_setup(self, ch):
         self.x_write(
             [
                 ":STOP",
@@ -289,46 +733,8 @@ class instOSC_DHO1204(bATEinst_base):
         )
         point = int(round(float(self.x_write([":ACQuire:MDEP?"])[0].strip())))
         self.x_write([":WAV:STAR 1", f":WAV:STOP {point}"])
-        pre = self.x_write(":WAV:PRE?")[0]
-        ff, tt, point, count, xinc, xor, xref, yinc, yor, yref = [float(k) for k in pre.split(",")]
-
-        mm = {
-            "xscale": [xinc, xor, xref],
-            "xinc": xinc,
-            "point": point,
-            "format": ff,
-            "count": count,
-            "type": tt,
-            "channels": [ch],
-            "time": str(datetime.fromtimestamp(time.time())),
-        }
-        yscale = [yinc, yor, yref]
-
-        mm[f"ch{ch}scale"] = yscale
-        dd = []
-        max_size = 125000
-        for st in range(1, int(point) + 1, max_size):
-            self.x_write(
-                [
-                    f":WAV:STAR {st}",
-                    f":WAV:STOP {(st + max_size - 1 if point >= st + max_size - 1 else point)}",
-                    "*OPC?",
-                ]
-            )
-            self.write(":WAV:DATA?")
-            dd += self.read_block()
-
-        ddar = np.array(dd, dtype=np.uint8)
-        mm[f"ch{ch}data"] = ddar
-        mm["scale"] = yscale
-        mm["data"] = ddar
-        return mm
-
-    def raw2float(self, raw, scale=None):
-        if isinstance(raw, dict):
-            scale = raw["scale"]
-            raw = raw["data"]
-        return (np.array(raw) - (scale[1] + scale[2])) * scale[0]
+        pre = self.x_write(":WAV:PRE?")[0].split(",")
+        return point, pre
 
     def test(self):
         self.start()
@@ -338,14 +744,112 @@ class instOSC_DHO1204(bATEinst_base):
         plt.show()
 
 
+class OSCCapture(object):
+    """Arm several instOSC_* together, wait until all of them have triggered, then
+    download their channels concurrently, one worker per scope (VISA session).
+
+    scopes: {name: instOSC} ; channels: {name: [ch, ...]}, displayed channels when missing.
+    capture() returns {name: read_waveforms() dict}."""
+
+    def __init__(self, scopes, channels=None):
+        self.scopes = scopes
+        self.channels = channels or {}
+
+    def arm(self):
+        for osc in self.scopes.values():
+            osc.arm()
+
+    def wait(self, timeout=10):
+        st = time.time()
+        pending = dict(self.scopes)
+        delays = backoff(
+            min(osc.Trig_Poll_Min for osc in pending.values()), min(osc.Trig_Poll for osc in pending.values())
+        )
+        while pending:
+            for name in [k for k, osc in pending.items() if osc.is_triggered()]:
+                del pending[name]
+            if pending:
+                if time.time() - st > timeout:
+                    raise bATEinst_Exception("trigger timeout after %.1fs: %s" % (timeout, ", ".join(pending)))
+                time.sleep(next(delays))
+        return time.time() - st
+
+    def download(self):
+        dataset = {}
+        with ThreadPoolExecutor(max_workers=max(1, len(self.scopes))) as pool:
+            jobs = {name: pool.submit(osc.read_waveforms, self.channels.get(name)) for name, osc in self.scopes.items()}
+            for name, job in jobs.items():
+                dataset[name] = job.result()
+        return dataset
+
+    def capture(self, timeout=10):
+        self.arm()
+        self.wait(timeout)
+        return self.download()
+
+    def stream(self, fn, count=None, duration=None, timeout=10, depth=4):
+        """Repeated captures saved as fn.format(k=index), e.g. "cap_{k:05d}.mat".
+
+        The scopes are re-armed as soon as a download finishes while a writer thread
+        saves the previous capture, fed through a queue of `depth` captures (the
+        loop blocks when the disk falls behind). Stops after `count` captures,
+        `duration` seconds or bATEinst_base.RequestStop. Returns timing statistics."""
+        files = queue.Queue(depth)
+        err = []
+
+        def work():
+            while True:
+                item = files.get()
+                if item is None:
+                    return
+                if not err:
+                    try:
+                        savemat(item[0], item[1], appendmat=False)
+                    except Exception as e:
+                        err.append(e)
+
+        th = threading.Thread(target=work, daemon=True)
+        th.start()
+        waits, loads = [], []
+        st = time.time()
+        try:
+            while not err and not bATEinst_base.RequestStop:
+                if count is not None and len(loads) >= count:
+                    break
+                if duration is not None and time.time() - st >= duration:
+                    break
+                self.arm()
+                waits.append(self.wait(timeout))
+                t0 = time.time()
+                dataset = self.download()
+                loads.append(time.time() - t0)
+                files.put((fn.format(k=len(loads) - 1), dataset))
+        finally:
+            files.put(None)
+            th.join()
+        if err:
+            raise err[0]
+        elapsed = time.time() - st
+        return {
+            "captures": len(loads),
+            "elapsed": elapsed,
+            "per_minute": len(loads) / elapsed * 60 if elapsed > 0 else 0.0,
+            "trigger_wait": sum(waits) / len(waits) if waits else 0.0,
+            "download": sum(loads) / len(loads) if loads else 0.0,
+        }
+
+
 class instSW_CP2102(bATEinst_base):
     Model_Supported = ["3000072"]
+    Settle_Time = 0.2
 
     def __init__(self):
         super().__init__("sw")
         self.VisaAddress = "COM7"
         self.get_cal_amp = None
         self.current_freq = 0
+        self.sw_state = None
+        self.settle_until = 0.0
 
     def inst_open(self):
         rr = re.match(r"COM(\d+)", self.VisaAddress)
@@ -355,13 +859,33 @@ class instSW_CP2102(bATEinst_base):
 
     def callback_after_open(self):
         self.Inst.set_visa_attribute(pyconst.VI_ATTR_ASRL_RTS_STATE, 0)
+        self.sw_state = True
+        self.settle_until = time.perf_counter() + self.Settle_Time
 
-    def set_sw(self, on=None):
+    def set_sw(self, on=None, wait=True):
+        """Switch (on / "rf": RF splitter, off / "awg": AWG). A switch to the current position
+        sends nothing. wait=False returns right away; the contacts are settled at settle_until
+        (perf_counter time), see wait_settled. Returns True if the switch moved."""
         self.check_open()
         if isinstance(on, str):
             on = on.lower() != "awg"
-        self.Inst.set_visa_attribute(pyconst.VI_ATTR_ASRL_RTS_STATE, 0 if on else 1)
-        time.sleep(0.2)
+        on = bool(on)
+        moved = on != self.sw_state
+        if moved:
+            self.Inst.set_visa_attribute(pyconst.VI_ATTR_ASRL_RTS_STATE, 0 if on else 1)
+            self.sw_state = on
+            self.settle_until = time.perf_counter() + self.Settle_Time
+        if wait:
+            self.wait_settled()
+        return moved
+
+    def settle_left(self):
+        return max(self.settle_until - time.perf_counter(), 0.0)
+
+    def wait_settled(self):
+        left = self.settle_left()
+        if left:
+            time.sleep(left)
 
     def test(self):
         self.set_sw(1)
@@ -372,15 +896,33 @@ class instSW_CP2102(bATEinst_base):
 class instSG_DSG836(bATEinst_base):
     Model_Supported = ["DSG836"]
 
+    SWEEP_TRIG_AUTO = "AUTO"
+    SWEEP_TRIG_BUS = "BUS"
+    SWEEP_TRIG_KEY = "KEY"
+    SWEEP_TRIG_EXT = "EXT"
+
+    Sweep_Setup = [":SWE:STAT LEV,FREQ", ":SWE:TYPE LIST", ":SWE:MODE SING", ":SWE:POIN:TRIG:TYPE %s"]
+    Sweep_List = (":SWE:LIST:FREQ %s", ":SWE:LIST:LEV %s", ":SWE:LIST:DWEL %s")
+    Sweep_Start = ":SWE:EXEC"
+    Sweep_Step = "*TRG"
+    Sweep_Off = ":SWE:STAT OFF"
+    # query of the list index (1-based) being output during an AUTO sweep; None when the
+    # firmware has none, then AUTO sweeps only report the measured total against the plan
+    Sweep_Point_Query = None
+    Sweep_Poll = 0.002
+
     def __init__(self):
         super().__init__("sg")
         self.VisaAddress = "USB::0x1AB1::0x099C::DSG8M253400109::INSTR"
-        self.get_cal_amp: intpl.interp1d = None
+        self.get_cal_amp = None
         self.current_freq = 0
+        self.sweep_plan = None
 
-    def calib_level(self, val):
+    def calib_level(self, val, freq=None):
+        # val and freq may be whole sweep vectors; get_cal_amp gives the loss in dB
         if self.get_cal_amp:
-            return val / math.pow(10, float(self.get_cal_amp(self.current_freq)) / 20)
+            freq = self.current_freq if freq is None else freq
+            return val / np.power(10, np.asarray(self.get_cal_amp(freq), dtype=float) / 20)
         else:
             return val
 
@@ -407,9 +949,103 @@ class instSG_DSG836(bATEinst_base):
     def set_lf_on(self, on=True):
         self.x_write([":LFO %d" % (1 if on else 0), "*OPC?"])
 
+    def set_list_sweep(self, freqs, levels_v, dwell=0.01, trigger=SWEEP_TRIG_AUTO):
+        """Upload a frequency (Hz) / level (V) list for the instrument to step through itself.
+        The calibration is applied to every point here; levels_v and dwell (s) may be scalars.
+        Returns the upload time in seconds."""
+        freqs = np.atleast_1d(np.asarray(freqs, dtype=float))
+        levels = np.broadcast_to(self.calib_level(np.asarray(levels_v, dtype=float), freqs), freqs.shape)
+        dwell = np.broadcast_to(np.asarray(dwell, dtype=float), freqs.shape)
+        t0 = time.perf_counter()
+        self.x_write(
+            self.Sweep_Setup[:-1]
+            + [self.Sweep_Setup[-1] % trigger]
+            + [
+                self.Sweep_List[0] % ",".join("%.2f" % k for k in freqs),
+                self.Sweep_List[1] % ",".join("%.6fV" % k for k in levels),
+                self.Sweep_List[2] % ",".join("%.4f" % k for k in dwell),
+                "*OPC?",
+            ]
+        )
+        self.sweep_plan = {"freq": freqs, "level": levels, "dwell": dwell, "trigger": trigger}
+        self.sweep_plan["upload"] = time.perf_counter() - t0
+        return self.sweep_plan["upload"]
+
+    def run_list_sweep(self, step_callback=None):
+        """Run the uploaded list once and return the timing report. start/step_time are
+        measured (s from start, nan where not observed); planned_start is the dwell schedule,
+        late = start - planned_start, overrun = elapsed - planned.
+        AUTO: the instrument dwells through the list; step starts are observed by polling
+        Sweep_Point_Query when it is set, otherwise only elapsed/overrun are measured.
+        BUS: every step is fired by *TRG, then step_callback(k, freq, level_v) runs (e.g. a
+        measurement). KEY/EXT: only starts the sweep."""
+        plan = self.sweep_plan
+        if plan is None:
+            self.set_error("No list sweep uploaded")
+        n = len(plan["freq"])
+        start = np.full(n, np.nan)
+        planned_start = np.concatenate(([0.0], np.cumsum(plan["dwell"][:-1])))
+        planned = float(plan["dwell"].sum())
+        steps = 0
+        t0 = time.perf_counter()
+        self.x_write([self.Sweep_Start])
+        if plan["trigger"] == self.SWEEP_TRIG_BUS:
+            for k in range(n):
+                if self.RequestStop:
+                    break
+                start[k] = time.perf_counter() - t0
+                self.x_write([self.Sweep_Step, "*OPC?"])
+                self.current_freq = plan["freq"][k]
+                steps = k + 1
+                if step_callback:
+                    step_callback(k, plan["freq"][k], plan["level"][k])
+        elif plan["trigger"] == self.SWEEP_TRIG_AUTO:
+            if self.Sweep_Point_Query:
+                # poll the index being output until the last step has dwelt (bounded by 2x plan)
+                while not self.RequestStop:
+                    idx = int(float(self.query(self.Sweep_Point_Query))) - 1
+                    now = time.perf_counter() - t0
+                    if 0 <= idx < n and np.isnan(start[idx]):
+                        start[idx] = now
+                    last = start[n - 1]
+                    if (not np.isnan(last) and now >= last + plan["dwell"][-1]) or now > 2 * planned + 1:
+                        break
+                    time.sleep(self.Sweep_Poll)
+            else:
+                self.delay(planned)
+            self.x_write(["*OPC?"])
+            self.current_freq = plan["freq"][-1]
+            steps = n
+        elapsed = time.perf_counter() - t0
+        seen = ~np.isnan(start)
+        return {
+            "steps": steps,
+            "upload": plan["upload"],
+            "start": start,
+            "step_time": np.diff(np.append(start, elapsed)),
+            "planned_start": planned_start,
+            "late": start - planned_start,
+            "planned": planned,
+            "elapsed": elapsed,
+            "overrun": elapsed - planned,
+            "per_step": elapsed / steps if steps else 0.0,
+            "observed": int(np.count_nonzero(seen)),
+        }
+
+    def stop_list_sweep(self):
+        self.x_write([self.Sweep_Off, "*OPC?"])
+
 
 class instAWG_DG4102(bATEinst_base):
     Model_Supported = ["DG4102"]
+    Amp_Cmd = ":SOUR%d:VOLT:AMPL %.4f"
+    Appl_Cmd = ":SOUR%d:APPL:%s %f,%.4f,%.4f"
+    Appl_DC_Cmd = ":SOUR%d:APPL:DC DEF,DEF,%.4f"
+    Wave_Keys = ("mode", "freq", "amp", "offset")
+    Arb_Max = 16383
+    Arb_Chunk = 16384
+    Arb_Cmd = ":SOUR%d:TRAC:DATA:DAC16 VOLATILE,%s,"
+    Burst_Cycles_Cmd = ":SOUR%d:BURS:NCYC %d"
 
     def __init__(self):
         super().__init__("awg")
@@ -418,6 +1054,7 @@ class instAWG_DG4102(bATEinst_base):
         self.get_cal_level = None
         self.freqs = [0, 0]
         self.levels = None
+        self.clear_state()
 
     def callback_after_open(self):
         pass
@@ -425,7 +1062,7 @@ class instAWG_DG4102(bATEinst_base):
     def calib_level(self, ch, val, freq=None):
         if self.get_cal_level:
             freq = self.freqs[ch - 1] if freq is None else freq
-            return val / float(self.get_cal_level[ch - 1](freq))
+            return val / np.asarray(self.get_cal_level[ch - 1](freq), dtype=float)
         else:
             return val
 
@@ -445,10 +1082,12 @@ class instAWG_DG4102(bATEinst_base):
             for ch, vv in enumerate(freq):
                 self.x_write([":SOUR%d:FREQ %f" % (ch + 1, vv), "*OPC?"])
                 self.freqs[ch] = vv
+                self.cache_state(ch + 1, freq=vv)
         else:
             for ch in self.ch2chs(ch):
                 self.x_write([":SOUR%d:FREQ %f" % (ch, freq), "*OPC?"])
                 self.freqs[ch - 1] = freq
+                self.cache_state(ch, freq=freq)
 
     def ch2chs(self, ch):
         chs = self.ch if ch is None else ch
@@ -459,27 +1098,122 @@ class instAWG_DG4102(bATEinst_base):
         return chs
 
     def set_reset(self):
+        self.clear_state()
         self.x_write(["*RST", "*OPC?", ":OUTP1:IMP INF", ":OUTP2:IMP INF"])
 
-    def set_mode(self, mode=MODE.SIN, ch=None):
+    def clear_state(self):
+        # forget the cached channel state, e.g. after a reset or front panel changes
+        self.chan_state = [{}, {}]
+        self.arb_hash = [None, None]
+
+    def cache_state(self, ch, **kv):
+        self.chan_state[ch - 1].update(kv)
+
+    @staticmethod
+    def mode_name(mode):
         if not isinstance(mode, str):
             mode = "PULSE" if mode == 2 else "DC" if mode == 0 else "SQU" if mode == 3 else "SIN"
+        return mode
+
+    def set_mode(self, mode=MODE.SIN, ch=None):
+        mode = self.mode_name(mode)
         for ch in self.ch2chs(ch):
             self.x_write([":SOUR%d:APPL:%s" % (ch, mode), "*OPC?"])
+            # APPL without parameters restores the default frequency/amplitude/offset
+            self.chan_state[ch - 1] = {k: v for k, v in self.chan_state[ch - 1].items() if k == "on"}
+            self.cache_state(ch, mode=mode)
+
+    def param_cmd(self, ch, key, st):
+        if key == "mode":
+            return ":SOUR%d:APPL:%s" % (ch, st["mode"])
+        if key == "freq":
+            return ":SOUR%d:FREQ %f" % (ch, st["freq"])
+        if key == "amp":
+            return self.Amp_Cmd % (ch, self.calib_level(ch, st["amp"]))
+        return ":SOUR%d:VOLT:OFFS %.4f" % (ch, self.calib_level(ch, st["offset"], 0))
+
+    def appl_cmd(self, ch, st):
+        if st["mode"] == "DC":
+            return self.Appl_DC_Cmd % (ch, self.calib_level(ch, st["offset"], 0))
+        return self.Appl_Cmd % (
+            ch,
+            st["mode"],
+            st["freq"],
+            self.calib_level(ch, st["amp"]),
+            self.calib_level(ch, st["offset"], 0),
+        )
+
+    def configure(self, ch=None, mode=None, freq=None, amp=None, offset=None, on=None):
+        """Bring channel(s) to a state in one command batch with a single *OPC?.
+        Values may be per-channel lists as for set_freq/set_amp, None leaves a parameter as is.
+        Only what differs from the cached state is sent; returns the commands written."""
+        req = dict(mode=mode, freq=freq, amp=amp, offset=offset, on=on)
+        cmds = []
+        for ch in self.ch2chs(ch):
+            st = self.chan_state[ch - 1]
+            new = {k: (v[ch - 1] if isinstance(v, list) else v) for k, v in req.items() if v is not None}
+            if "mode" in new:
+                new["mode"] = self.mode_name(new["mode"])
+            if "on" in new:
+                new["on"] = bool(new["on"])
+            diff = [k for k in self.Wave_Keys if k in new and st.get(k) != new[k]]
+            full = {**st, **new}
+            if "freq" in full:
+                self.freqs[ch - 1] = full["freq"]
+            if "freq" in diff and self.get_cal_level and "amp" in full and "amp" not in diff:
+                # the calibrated amplitude depends on the frequency
+                diff.append("amp")
+            known = all(k in full for k in self.Wave_Keys)
+            if diff and known and ("mode" in diff or len(diff) > 1):
+                cmds.append(self.appl_cmd(ch, full))
+            elif "mode" in diff:
+                cmds += [self.param_cmd(ch, k, full) for k in self.Wave_Keys if k in full]
+            else:
+                cmds += [self.param_cmd(ch, k, full) for k in diff]
+            if "on" in new and st.get("on") != new["on"]:
+                cmds.append(":OUTP%d %d" % (ch, 1 if new["on"] else 0))
+            st.update(new)
+        if cmds:
+            self.x_write(cmds + ["*OPC?"])
+        return cmds
+
+    def quantize_arb(self, wave):
+        """(DAC codes "<u2", Vpp, offset) of a waveform in volts, full DAC range = its min..max."""
+        wave = np.asarray(wave, dtype=float)
+        lo, hi = float(wave.min()), float(wave.max())
+        span = hi - lo if hi > lo else 1.0
+        codes = np.rint((wave - lo) * (self.Arb_Max / span)).astype("<u2")
+        return codes, hi - lo, (hi + lo) / 2
+
+    def set_arb(self, wave, freq, ch=None):
+        """Play one period of `wave` (volts, numpy array) at freq Hz on the channel(s).
+        The points are uploaded as binary DAC blocks of Arb_Chunk points (CON ... END),
+        skipped when the channel already holds the same codes. Returns True if uploaded.
+        A constant waveform has no amplitude to scale to, it is output as DC instead."""
+        codes, amp, offset = self.quantize_arb(wave)
+        if amp == 0:
+            self.configure(ch, self.MODE.DC, freq, 0, offset)
+            return False
+        digest = hashlib.sha1(codes.tobytes()).hexdigest()
+        uploaded = False
+        for ch in self.ch2chs(ch):
+            if self.arb_hash[ch - 1] != digest:
+                self.arb_hash[ch - 1] = None
+                for k in range(0, len(codes), self.Arb_Chunk):
+                    last = k + self.Arb_Chunk >= len(codes)
+                    self.write_block(codes[k : k + self.Arb_Chunk], self.Arb_Cmd % (ch, "END" if last else "CON"))
+                self.x_write(["*OPC?"])
+                self.arb_hash[ch - 1] = digest
+                self.chan_state[ch - 1].pop("mode", None)
+                uploaded = True
+            self.configure(ch, "USER", freq, amp, offset)
+        return uploaded
 
     def set_sine_mode(self, freq=1e8, amp=0.01, ch=None):
-        self.set_mode(self.MODE.SIN, ch)
-        self.set_freq(freq, ch)
-        self.set_amp(amp, ch)
-        self.set_offset(0, ch)
-        self.set_on(True, ch)
+        self.configure(ch, self.MODE.SIN, freq, amp, 0, True)
 
     def set_dc_mode(self, dc=0, ch=None):
-        self.set_mode(self.MODE.SIN, ch)
-        self.set_freq(1e-6, ch)
-        self.set_amp(1e-3, ch)
-        self.set_offset(dc, ch)
-        self.set_on(True, ch)
+        self.configure(ch, self.MODE.SIN, 1e-6, 1e-3, dc, True)
 
     def set_phase(self, ph, ch=None):
         for ch in self.ch2chs(ch):
@@ -492,10 +1226,18 @@ class instAWG_DG4102(bATEinst_base):
     def set_amp(self, amp, ch=None):
         if isinstance(amp, list):
             for ch, vv in enumerate(amp):
-                self.x_write([":SOUR%d:VOLT:AMPL %.4f" % (ch + 1, self.calib_level(ch + 1, vv)), "*OPC?"])
+                self.x_write([self.Amp_Cmd % (ch + 1, self.calib_level(ch + 1, vv)), "*OPC?"])
+                self.cache_state(ch + 1, amp=vv)
         else:
             for ch in self.ch2chs(ch):
-                self.x_write([":SOUR%d:VOLT:AMPL %.4f" % (ch, self.calib_level(ch, amp)), "*OPC?"])
+                self.x_write([self.Amp_Cmd % (ch, self.calib_level(ch, amp)), "*OPC?"])
+                self.cache_state(ch, amp=amp)
+
+    def set_burst_cycles(self, n, ch=None):
+        for ch in self.ch2chs(ch):
+            if self.chan_state[ch - 1].get("ncyc") != n:
+                self.x_write([self.Burst_Cycles_Cmd % (ch, n), "*OPC?"])
+                self.cache_state(ch, ncyc=n)
 
     def set_burst_phase(self, ph, ch=None):
         for ch in self.ch2chs(ch):
@@ -505,15 +1247,19 @@ class instAWG_DG4102(bATEinst_base):
         if isinstance(v, list):
             for ch, vv in enumerate(v):
                 self.x_write([":SOUR%d:VOLT:OFFS %.4f" % (ch + 1, self.calib_level(ch + 1, vv, 0)), "*OPC?"])
+                self.cache_state(ch + 1, offset=vv)
         else:
             for ch in self.ch2chs(ch):
                 self.x_write([":SOUR%d:VOLT:OFFS %.4f" % (ch, self.calib_level(ch, v, 0)), "*OPC?"])
+                self.cache_state(ch, offset=v)
 
     def set_on(self, on=True, ch=None):
         for ch in self.ch2chs(ch):
             self.x_write([":OUTP%d %d" % (ch, (1 if on else 0)), "*OPC?"])
+            self.cache_state(ch, on=bool(on))
 
     def set_data_rate_test(self, afreq=200e3, bfreq=100, bursts=500, level=3.3):
+        self.clear_state()
         self.x_write(
             [
                 "*RST",
@@ -534,12 +1280,19 @@ class instAWG_DG4102(bATEinst_base):
                 "*OPC?",
             ]
         )
+        self.cache_data_rate_test(afreq, bfreq, bursts, level)
 
     def fire_burst_manul_trigger(self, ch=None):
         for ch in self.ch2chs(ch):
             self.x_write([":SOUR%d:BURS:TRIG" % ch, "*OPC?"])
 
+    def cache_data_rate_test(self, afreq, bfreq, bursts, level):
+        # state left by set_data_rate_test, so later configure()/set_burst_cycles() only send changes
+        self.cache_state(1, mode="SQU", freq=afreq, amp=level / 2, offset=level / 4, on=True)
+        self.cache_state(2, mode="SQU", freq=bfreq, amp=level / 2, offset=level / 4, on=True, ncyc=bursts)
+
     def reset(self):
+        self.clear_state()
         self.x_write(
             [
                 ":SYST:PRES DEF",
@@ -556,27 +1309,29 @@ class instAWG_DG4102(bATEinst_base):
 
 class instAWG_DG852(instAWG_DG4102):
     Model_Supported = ["DG852"]
+    Amp_Cmd = ":SOUR%d:VOLT %.4f"
+    # DG800 series: 16-bit vertical resolution, DAC16 codes span 0..65535
+    Arb_Max = 65535
 
     def __init__(self):
         super().__init__()
         self.VisaAddress = "USB::0x1AB1::0x0646::DG8R262900659::INSTR"
 
     def set_reset(self):
+        self.clear_state()
         self.x_write(["*RST", "$WAIT=1500$", "*OPC?", ":OUTP1:LOAD 50", ":OUTP2:LOAD 50"])
 
-    def set_amp(self, amp, ch=None):
-        if isinstance(amp, list):
-            for ch, vv in enumerate(amp):
-                self.x_write([":SOUR%d:VOLT %.4f" % (ch + 1, self.calib_level(ch + 1, vv)), "*OPC?"])
-        else:
-            for ch in self.ch2chs(ch):
-                self.x_write([":SOUR%d:VOLT %.4f" % (ch, self.calib_level(ch, amp)), "*OPC?"])
+    def set_arb(self, wave, freq, ch=None):
+        # the DG800 plays arbitrary data through APPL:ARB with a sample rate, not the DG4102
+        # APPL:USER path; not implemented until the upload/play commands are confirmed
+        self.set_error("Function not implemented")
 
     def phase_sync(self, ch=None):
         for ch in self.ch2chs(ch):
             self.x_write([":SOUR%d:PHAS:SYNC" % (ch), "*OPC?"])
 
     def set_data_rate_test(self, afreq=200e3, bfreq=100, bursts=500, level=3.3):
+        self.clear_state()
         self.x_write(
             [
                 "*RST",
@@ -602,12 +1357,14 @@ class instAWG_DG852(instAWG_DG4102):
                 "*OPC?",
             ]
         )
+        self.cache_data_rate_test(afreq, bfreq, bursts, level)
 
     def fire_burst_manul_trigger(self, ch=None):
         for ch in self.ch2chs(ch):
             self.x_write([f":TRIG{ch}", "*OPC?"])
 
     def reset(self):
+        self.clear_state()
         self.x_write(
             [
                 "*RST",
@@ -625,32 +1382,148 @@ class instAWG_DG852(instAWG_DG4102):
 
 class instDC_KA3003P(bATEinst_base):
     Model_Supported = ["KA3003P"]
+    Reply_Len = 5
+    Query_Retry = 1
+    Log_Timeout = 100
+    Settle_Tol = 0.05
+    Settle_Timeout = 2.0
+    Settle_Poll = 0.01
 
     def __init__(self):
         super().__init__("dc")
         self.VisaAddress = "ASRL7::INSTR"
+        self.v_set = None
+        self.i_set = None
+
+    def query_value(self, cmd):
+        # replies are Reply_Len characters without terminator: read exactly that many bytes
+        # instead of waiting for a read timeout; a garbled/missing reply is retried, then raised
+        for k in range(self.Query_Retry + 1):
+            with self.io_lock:
+                try:
+                    self.write(cmd)
+                    return float(self.read_raw(self.Reply_Len))
+                except (ValueError, bATEinst_Exception, visa.VisaIOError) as e:
+                    err = e
+        self.set_error("%s failed: %s" % (cmd, err))
 
     def measure_v(self):
-        return float(self.x_write(["VOUT1?"])[0])
+        return self.query_value("VOUT1?")
 
     def measure_i(self):
-        try:
-            return float(self.x_write(["IOUT1?"])[0])
-        except Exception:
-            return float(self.x_write(["IOUT1?"])[0])
+        return self.query_value("IOUT1?")
 
     def measure_iv(self):
-        return (self.measure_i(), self.measure_v())
+        # both readings back to back under one lock, so nothing else runs between them
+        with self.io_lock:
+            return (self.measure_i(), self.measure_v())
+
+    def log_iv(self, store=None, count=None, duration=None, interval=0):
+        """Log (time, i, v) rows into a SampleStore as fast as the serial link allows (or every
+        interval s), until count rows / duration s / RequestStop. time is s from start, taken in
+        the middle of each pair. Reads use Log_Timeout ms, so a lost reply costs little.
+        Can run in the background via submit(self.log_iv, store, ...)."""
+        store = SampleStore(("time", "i", "v")) if store is None else store
+        self.check_open()
+        tmo = getattr(self.Inst, "timeout", None)
+        if tmo is not None:
+            self.Inst.timeout = self.Log_Timeout
+        try:
+            t0 = next_t = time.perf_counter()
+            n = 0
+            while not self.RequestStop and (count is None or n < count):
+                ta = time.perf_counter()
+                if duration is not None and ta - t0 >= duration:
+                    break
+                i, v = self.measure_iv()
+                store.append((ta + time.perf_counter()) / 2 - t0, i, v)
+                n += 1
+                if interval:
+                    next_t += interval
+                    wait = next_t - time.perf_counter()
+                    if wait > 0:
+                        time.sleep(wait)
+        finally:
+            if tmo is not None:
+                self.Inst.timeout = tmo
+        return store
 
     def set_v(self, v):
         self.x_write(["VSET1:%.2fV" % v])
+        self.v_set = v
 
     def set_i(self, v):
         self.x_write(["ISET1:%.3fV" % v])
+        self.i_set = v
 
-    def set_on(self, on=True):
+    def set_on(self, on=True, settle=True):
+        # instead of a fixed delay, switching on waits until the readback reaches the set point
         self.x_write(["OUT%d" % (1 if on else 0)])
-        time.sleep(0.5)
+        if on and settle:
+            return self.wait_settled()
+
+    def wait_settled(self, v=None, tol=None, timeout=None):
+        """Poll the output until it is within tol volts of v (default the last set_v, read back
+        with VSET1? when not set in this session) or the supply is current limiting.
+        Returns the seconds it took, None on timeout."""
+        if v is None and self.v_set is None:
+            self.v_set = self.query_value("VSET1?")
+        if self.i_set is None:
+            self.i_set = self.query_value("ISET1?")
+        v = self.v_set if v is None else v
+        tol = self.Settle_Tol if tol is None else tol
+        timeout = self.Settle_Timeout if timeout is None else timeout
+        st = time.perf_counter()
+        delays = backoff(self.Settle_Poll, 0.1)
+        while True:
+            i, vv = self.measure_iv()
+            if abs(vv - v) <= tol or (self.i_set and i >= self.i_set * 0.98):
+                return time.perf_counter() - st
+            if time.perf_counter() - st > timeout:
+                return None
+            time.sleep(next(delays))
+
+    def run_sequence(self, steps, readback=False, settle=False):
+        """Apply (v, i, dwell) steps on a deadline schedule (step k starts at the sum of the
+        previous dwells, so write/readback time does not accumulate). Unchanged set points are
+        not re-sent. settle: confirm each step by readback before its dwell; readback: log
+        (i, v) at every step. Returns the timing report with one array entry per step."""
+        n = len(steps)
+        rows = SampleStore(("time", "late", "v_set", "i_set", "settle", "i", "v"), max(n, 1))
+        t0 = time.perf_counter()
+        deadline = t0
+        for v, i, dwell in steps:
+            if self.RequestStop:
+                break
+            now = time.perf_counter()
+            if deadline > now:
+                time.sleep(deadline - now)
+            ts = time.perf_counter()
+            if i is not None and i != self.i_set:
+                self.set_i(i)
+            if v is not None and v != self.v_set:
+                self.set_v(v)
+            st = self.wait_settled() if settle else None
+            iv = self.measure_iv() if readback else (np.nan, np.nan)
+            rows.append(ts - t0, ts - deadline, self.v_set, self.i_set, np.nan if st is None else st, *iv)
+            deadline += dwell
+        # the last step holds for its dwell too
+        now = time.perf_counter()
+        if not self.RequestStop and deadline > now:
+            time.sleep(deadline - now)
+        res = rows.columns()
+        res["elapsed"] = time.perf_counter() - t0
+        res["steps"] = len(rows)
+        res["max_late"] = float(res["late"].max()) if len(rows) else 0.0
+        return res
+
+    def ramp(self, start, stop, points=11, dwell=0.1, i=None, readback=False, settle=False):
+        """Voltage ramp start..stop in `points` steps of `dwell` s (current limit i), see run_sequence."""
+        return self.run_sequence([(v, i, dwell) for v in np.linspace(start, stop, points)], readback, settle)
+
+    def ramp_i(self, start, stop, points=11, dwell=0.1, v=None, readback=False, settle=False):
+        """Current limit ramp start..stop at voltage v, see run_sequence."""
+        return self.run_sequence([(v, i, dwell) for i in np.linspace(start, stop, points)], readback, settle)
 
     def test(self):
         self.set_v(3.3)
@@ -669,6 +1542,14 @@ class instTrigger(bATEinst_base):
     CMD_CCSIZE = 1
     CMD_STATE = 2
 
+    # request "SV", 0, cmd, value / reply 2 x uint32, the first byte is b"s"
+    Frame = struct.Struct("<2sBBI")
+    Reply = struct.Struct("<II")
+    Resync_Bytes = 256
+    Resync_Delay = 0.5
+    Done_Poll_Min = 0.0005
+    Done_Poll = 0.02
+
     def __init__(self):
         super().__init__("pwm")
         self.VisaAddress = "COM4"
@@ -688,30 +1569,36 @@ class instTrigger(bATEinst_base):
         acycles = round(1e8 / afreq) - 1
         bcycles = round(afreq / bfreq)
         absize = acycles + (bcycles << 16)
-        self.send(self.CMD_CCSIZE, 0x0000_0000)
-        self.send(self.CMD_ABSIZE, absize)
-        self.send(self.CMD_CCSIZE, csize + 0x8000_0000)
+        self.send_many(
+            [(self.CMD_CCSIZE, 0x0000_0000), (self.CMD_ABSIZE, absize), (self.CMD_CCSIZE, csize + 0x8000_0000)]
+        )
 
     def wait_done(self, maxdelay=10):
+        # poll fast right after the trigger, then back off to Done_Poll
         st = time.time()
+        delays = backoff(self.Done_Poll_Min, self.Done_Poll)
         while time.time() - st < maxdelay:
             v = self.send(self.CMD_STATE, 0x0000_0000)
-            if (v & 0x03 == 2):
+            if (v & 0x03) == 2:
                 break
-            time.sleep(0.1)
+            time.sleep(next(delays))
         return time.time() - st
 
     def send(self, cmd, value):
+        return self.send_many([(cmd, value)])[0]
+
+    def send_many(self, frames):
+        """Write all (cmd, value) register frames in one write and return the reply values.
+        On a bad reply the link is resynchronized and the batch is sent once more."""
         self.check_open()
+        req = b"".join(self.Frame.pack(b"SV", 0, cmd, value) for cmd, value in frames)
+        size = self.Reply.size * len(frames)
         for _ in range(2):
-            if self.Inst.in_waiting > 0:
-                self.Inst.read(self.Inst.in_waiting)
-            self.Inst.write(list("SV".encode("utf-8")) + [0, cmd] + list(struct.pack("I", value)))
-            ret = self.Inst.read(8)
-            if len(ret) == 8 and ret[0] == "s":
-                break
-            self.Inst.write([0] * 256)
-            time.sleep(0.5)
-        if len(ret) != 8:
-            self.set_error("return error")
-        return struct.unpack("II", ret)[1]
+            self.Inst.write(req)
+            ret = self.Inst.read(size)
+            if len(ret) == size and all(ret[k : k + 1] == b"s" for k in range(0, size, self.Reply.size)):
+                return [self.Reply.unpack_from(ret, k)[1] for k in range(0, size, self.Reply.size)]
+            self.Inst.write(bytes(self.Resync_Bytes))
+            time.sleep(self.Resync_Delay)
+            self.Inst.reset_input_buffer()
+        self.set_error("return error")
@@ -0,0 +1,224 @@
+"""
+Stimulus-response sweeps: step a stimulus instrument (AWG, SG, ...) through a list of points
+and read one or more measurement instruments at every point. A measurement is split in
+acquire (runs while the stimulus is held) and download (only talks to the instrument that
+captured), so the setup of the next point overlaps the download of the current one whenever
+the stimulus is not also one of the measurement instruments. Results are one numpy column
+per point parameter, measured value and timing. DataRateHarness runs the AWG/instTrigger
+data-rate test cycles on top of the same engine.
+"""
+
+import itertools
+import numbers
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from dmm_driver import bATEinst_base, bATEinst_Exception
+from legacy_instruments import save_columns
+
+
+def grid(**axes):
+    """Points of the cartesian product of the axes, last axis fastest:
+    grid(freq=[1e3, 1e4], amp=[0.1, 0.2]) -> [{"freq": 1e3, "amp": 0.1}, ...]"""
+    names = list(axes)
+    return [dict(zip(names, vv)) for vv in itertools.product(*axes.values())]
+
+
+def apply_point(inst, point):
+    """Default stimulus step: AWG configure(**point) (keys ch/mode/freq/amp/offset/on),
+    set_freq/set_amp_v for the freq/amp keys otherwise (SG)."""
+    if hasattr(inst, "configure"):
+        inst.configure(**point)
+    else:
+        if "freq" in point:
+            inst.set_freq(point["freq"])
+        if "amp" in point:
+            inst.set_amp_v(point["amp"])
+
+
+class Measurement(object):
+    """acquire(point) runs while the stimulus is held and returns a token, download(token)
+    returns {column: value} (a plain value is stored under name) and may overlap the next setup."""
+
+    def __init__(self, name, inst, acquire, download=None):
+        self.name = name
+        self.inst = inst
+        self.acquire = acquire
+        self.download = download
+
+    def read(self, token):
+        res = self.download(token) if self.download else token
+        return res if isinstance(res, dict) else {self.name: res}
+
+
+def dmm_measurement(name, mm):
+    return Measurement(name, mm, lambda point: mm.measure())
+
+
+def scope_measurement(name, osc, chs=(1,), reduce=None, timeout=10):
+    """Trigger while the stimulus is held, then download every channel and reduce it
+    (reduce(WaveformView) -> {metric: value}, default waveform_analysis.analyze_view).
+    Columns are named name_ch<n>_<metric>."""
+    if reduce is None:
+        from waveform_analysis import analyze_view as reduce
+
+    def acquire(point):
+        osc.arm()
+        osc.wait_triggered(timeout)
+
+    def download(token):
+        res = {}
+        for ch in chs:
+            for k, v in reduce(osc.scaled(osc.read_waveform(ch))).items():
+                res["%s_ch%d_%s" % (name, ch, k)] = v
+        return res
+
+    return Measurement(name, osc, acquire, download)
+
+
+class SweepEngine(object):
+    def __init__(self, stimulus, measurements, setup=None, settle=0.0, overlap=True, settlers=()):
+        """stimulus: instrument stepped by setup(point) (default apply_point)
+        measurements: Measurement objects, or instruments wrapped by Equip_Type ("mm", "osc")
+        settle: seconds from the end of a setup to the acquisition, scalar or one per point
+        overlap: set up the next point while the current one downloads (only when safe)
+        settlers: instruments with a settle_until deadline (e.g. instSW_CP2102 switched with
+        wait=False in setup), the acquisition also waits for them instead of setup sleeping"""
+        self.stimulus = stimulus
+        self.measurements = [self.wrap(m) for m in measurements]
+        self.setup = setup or (lambda point: apply_point(stimulus, point))
+        self.settle = settle
+        self.settlers = list(settlers)
+        self.overlap = overlap and all(m.inst is not stimulus for m in self.measurements)
+        self.stats = {}
+
+    @staticmethod
+    def wrap(m):
+        if isinstance(m, Measurement):
+            return m
+        if m.Equip_Type == "mm":
+            return dmm_measurement(m.Name, m)
+        if m.Equip_Type == "osc":
+            return scope_measurement(m.Name, m)
+        raise bATEinst_Exception("No default measurement for %s" % m.Equip_Type)
+
+    def timed_setup(self, point):
+        st = time.perf_counter()
+        self.setup(point)
+        return st, time.perf_counter()
+
+    def run(self, points, fn=None):
+        """Sweep the points (dicts of stimulus parameters, see grid) and return the dataset
+        {column: array}: the point parameters, every measured value, time (s from start),
+        t_setup, t_wait (settle left after setup), t_acquire and t_download. Saved with
+        save_columns when fn is given."""
+        points = list(points)
+        n = len(points)
+        settle = np.broadcast_to(np.asarray(self.settle, dtype=float), (n,))
+        data = {}
+
+        def put(k, name, v):
+            # numeric values go to float columns, anything else (e.g. mode "SIN") to object columns
+            numeric = isinstance(v, (numbers.Real, np.bool_))
+            if name not in data:
+                data[name] = np.full(n, np.nan) if numeric else np.full(n, None, dtype=object)
+            elif not numeric and data[name].dtype != object:
+                data[name] = data[name].astype(object)
+            data[name][k] = v
+
+        t0 = time.perf_counter()
+        rows = 0
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = pool.submit(self.timed_setup, points[0]) if n else None
+            for k, point in enumerate(points):
+                if bATEinst_base.RequestStop:
+                    break
+                st, end = pending.result()
+                ready = max([end + settle[k]] + [inst.settle_until for inst in self.settlers])
+                wait = ready - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+                ta = time.perf_counter()
+                tokens = [m.acquire(point) for m in self.measurements]
+                td = time.perf_counter()
+                if self.overlap and k + 1 < n:
+                    pending = pool.submit(self.timed_setup, points[k + 1])
+                for m, token in zip(self.measurements, tokens):
+                    for name, v in m.read(token).items():
+                        put(k, name, v)
+                te = time.perf_counter()
+                if not self.overlap and k + 1 < n:
+                    pending = pool.submit(self.timed_setup, points[k + 1])
+                for name, v in point.items():
+                    put(k, name, v)
+                put(k, "time", ta - t0)
+                put(k, "t_setup", end - st)
+                put(k, "t_wait", max(wait, 0.0))
+                put(k, "t_acquire", td - ta)
+                put(k, "t_download", te - td)
+                rows = k + 1
+        data = {name: col[:rows] for name, col in data.items()}
+        elapsed = time.perf_counter() - t0
+        self.stats = {
+            "points": rows,
+            "elapsed": elapsed,
+            "per_point": elapsed / rows if rows else 0.0,
+            "overlap": self.overlap,
+        }
+        if fn and rows:
+            save_columns(fn, np.column_stack(list(data.values())), list(data), header=True)
+        return data
+
+
+class DataRateHarness(object):
+    """Data-rate / BER runs: burst, trigger and wait cycles over a grid of A frequencies and
+    burst counts. The AWG is set up once with set_data_rate_test, later points only send what
+    changed (channel 1 frequency, channel 2 burst count)."""
+
+    def __init__(self, awg, trig=None, check=None, bfreq=100, level=3.3, csize=None, timeout=10):
+        """trig: instTrigger started and polled every cycle, None fires the AWG burst manually
+        check(point) -> value or {column: value}: the result of one cycle (errors counted, ...)
+        csize: instTrigger csize, default the burst count of the point"""
+        self.awg = awg
+        self.trig = trig
+        self.check = check
+        self.bfreq = bfreq
+        self.level = level
+        self.csize = csize
+        self.timeout = timeout
+        self.configured = False
+        self.stats = {}
+
+    def setup(self, point):
+        if not self.configured:
+            self.awg.set_data_rate_test(point["afreq"], self.bfreq, point["bursts"], self.level)
+            self.configured = True
+        else:
+            self.awg.configure(1, freq=point["afreq"])
+            self.awg.set_burst_cycles(point["bursts"], 2)
+
+    def cycle(self, point):
+        if self.trig:
+            self.trig.trigger(point["afreq"], self.bfreq, self.csize or point["bursts"])
+            wait = self.trig.wait_done(self.timeout)
+            res = {"done": wait < self.timeout, "t_done": wait}
+        else:
+            self.awg.fire_burst_manul_trigger(2)
+            res = {"done": True, "t_done": np.nan}
+        if self.check:
+            val = self.check(point)
+            res.update(val if isinstance(val, dict) else {"result": val})
+        return res
+
+    def run(self, afreqs, bursts, repeats=1, fn=None):
+        """One cycle per (afreq, bursts, repeat), repeats of a point run back to back.
+        Returns the SweepEngine dataset; self.stats adds cycles_per_minute."""
+        points = [dict(p, repeat=k) for p in grid(afreq=afreqs, bursts=bursts) for k in range(repeats)]
+        engine = SweepEngine(self.awg, [Measurement("cycle", self.trig, self.cycle)], self.setup, overlap=False)
+        data = engine.run(points, fn)
+        self.stats = dict(engine.stats)
+        self.stats["cycles_per_minute"] = 60 * engine.stats["points"] / engine.stats["elapsed"] if points else 0.0
+        self.stats["failed"] = int(np.count_nonzero(data["done"] == 0)) if "done" in data else 0
+        return data
@@ -0,0 +1,134 @@
+"""
+Vectorized analysis of downloaded oscilloscope captures (read_waveform / read_waveforms
+dicts, .mat files saved from them, or MDO34 binary files): RMS, peak-to-peak, windowed
+FFT, frequency and duty cycle. Long captures are processed chunk by chunk so memory
+stays bounded by `chunk` / `nfft` samples, whatever the capture length.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.io import loadmat
+
+from legacy_instruments import WaveformView, load_wfm, waveform_view
+
+CHUNK = 1 << 20
+
+
+def views(mm, ch=None):
+    """{channel: WaveformView} of a capture dict, a single channel when ch is given."""
+    if isinstance(mm, WaveformView):
+        return {ch: mm}
+    if ch is not None:
+        return {ch: waveform_view(mm, ch=ch)}
+    if "data" in mm:
+        return {int(np.ravel(mm["channels"])[0]) if "channels" in mm else None: waveform_view(mm)}
+    return {int(k): waveform_view(mm, ch=int(k)) for k in np.ravel(mm["channels"])}
+
+
+def edges(wv, hysteresis=0.1, chunk=CHUNK):
+    """Rising and falling edge sample indexes, Schmitt trigger around the mid level
+    with +-hysteresis of the peak-to-peak range (raw codes, no float conversion)."""
+    n, lo, hi, s1, s2 = wv.raw_moments()
+    mid, band = (lo + hi) / 2, (hi - lo) * hysteresis / 2
+    rises, falls = [], []
+    state = None
+    for k in range(0, len(wv.raw), chunk):
+        blk = np.asarray(wv.raw[k : k + chunk])
+        above, below = blk > mid + band, blk < mid - band
+        if wv.y_inc < 0:
+            above, below = below, above
+        ev = np.flatnonzero(above | below)
+        if not len(ev):
+            continue
+        st = above[ev]
+        prev = np.empty_like(st)
+        prev[0] = st[0] if state is None else state
+        prev[1:] = st[:-1]
+        rises.append(ev[st & ~prev] + k)
+        falls.append(ev[~st & prev] + k)
+        state = st[-1]
+    cat = lambda vv: np.concatenate(vv) if vv else np.empty(0, np.int64)
+    return cat(rises), cat(falls)
+
+
+def frequency_duty(wv, hysteresis=0.1, chunk=CHUNK):
+    """(frequency Hz, duty cycle 0..1) over the complete periods of the capture, nan when
+    fewer than two rising edges are found."""
+    rises, falls = edges(wv, hysteresis, chunk)
+    if len(rises) < 2:
+        return float("nan"), float("nan")
+    span = rises[-1] - rises[0]
+    falls = falls[(falls > rises[0]) & (falls < rises[-1])]
+    duty = (falls - rises[: len(falls)]).sum() / span if len(falls) == len(rises) - 1 else float("nan")
+    return float((len(rises) - 1) / (span * wv.x_inc)), float(duty)
+
+
+def fft(wv, nfft=1 << 16, window=np.hanning):
+    """Averaged windowed spectrum (Welch, 50 % overlap) in segments of nfft samples.
+    Returns (freq Hz, amplitude V peak) single sided."""
+    nfft = min(nfft, len(wv))
+    win = window(nfft).astype(np.float32)
+    gain = win.sum() / 2
+    acc = np.zeros(nfft // 2 + 1)
+    segs = 0
+    for k in range(0, len(wv) - nfft + 1, max(nfft // 2, 1)):
+        seg = wv.astype(np.float32)[k : k + nfft]
+        seg -= seg.mean()
+        acc += np.abs(np.fft.rfft(seg * win)) ** 2
+        segs += 1
+    amp = np.sqrt(acc / max(segs, 1)) / gain
+    return np.fft.rfftfreq(nfft, wv.x_inc), amp
+
+
+def analyze_view(wv, nfft=1 << 16, hysteresis=0.1, chunk=CHUNK):
+    freq, duty = frequency_duty(wv, hysteresis, chunk)
+    ff, amp = fft(wv, nfft)
+    peak = int(np.argmax(amp[1:])) + 1 if len(amp) > 1 else 0
+    return {
+        "points": len(wv),
+        "mean": wv.mean(),
+        "rms": wv.rms(),
+        "pk2pk": wv.max() - wv.min(),
+        "frequency": freq,
+        "duty": duty,
+        "fft_peak_freq": float(ff[peak]),
+        "fft_peak_amp": float(amp[peak]),
+    }
+
+
+def analyze(mm, ch=None, **kw):
+    """{channel: metrics} for every channel of a capture (or only ch). A multi-scope capture
+    (OSCCapture.download / stream: {scope name: capture}) gives {scope name: {channel: metrics}}."""
+    if isinstance(mm, dict) and "data" not in mm and "channels" not in mm:
+        scopes = {k: v for k, v in mm.items() if isinstance(v, dict)}
+        if scopes:
+            return {name: analyze(sub, ch, **kw) for name, sub in scopes.items()}
+    return {k: analyze_view(wv, **kw) for k, wv in views(mm, ch).items()}
+
+
+def load_capture(fn):
+    if os.path.splitext(fn)[1].lower() == ".mat":
+        return loadmat(fn, simplify_cells=True)
+    return load_wfm(fn)
+
+
+def analyze_file(fn, **kw):
+    """analyze() of a .mat capture (single scope or OSCCapture.stream file) or an MDO34 binary file."""
+    mm = load_capture(fn)
+    if isinstance(mm, dict) and all(isinstance(k, int) for k in mm):
+        return {k: analyze_view(wv, **kw) for k, wv in mm.items()}
+    return analyze(mm, **kw)
+
+
+def analyze_files(fns, processes=None, **kw):
+    """analyze_file for many saved captures, in a process pool when processes > 1."""
+    if processes and processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            return list(pool.map(_analyze_file_kw, [(fn, kw) for fn in fns]))
+    return [analyze_file(fn, **kw) for fn in fns]
+
+
+def _analyze_file_kw(args):
+    return analyze_file(args[0], **args[1])